@@ -2,6 +2,10 @@ def get_data(name):
     return f'../assets/data/{name}.txt'
 
 
+def get_cache(name):
+    return f'../cache/{name}.pickle'
+
+
 def get_ship(name, space):
     return f'../assets/images/ships/{name}/{space.name}.png'
 
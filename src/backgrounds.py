@@ -1,6 +1,7 @@
 import assets
 import game
 import helpers
+import images
 import numpy as np
 import random
 
@@ -54,6 +55,42 @@ class BackgroundStar(BackgroundSprite):
         super().__init__(image, scale, pos, dist, rand)
 
 
+class Starfield:
+    def __init__(self, sprites):
+        sprites = list(sprites)
+        self.images = [x.image for x in sprites]
+        self.pos = np.array([x.pos for x in sprites], dtype=np.float64).reshape(-1, 2)
+        self.dist = np.array([x.dist for x in sprites], dtype=np.float64)
+        self.padding = np.array([x.padding for x in sprites], dtype=np.float64)
+        self.rand = np.array([x.rand for x in sprites], dtype=np.bool_)
+
+    def draw(self, camera):
+        display_size = game.screen.display_size
+        offset = camera / self.dist[:, np.newaxis]
+        pos_blit = self.pos - offset
+        padding = self.padding[:, np.newaxis]
+
+        pos_mod = helpers.extended_mod_array(pos_blit, display_size, padding)
+        out_of_bounds = (pos_blit < -padding) | (pos_blit > display_size + padding)
+        if out_of_bounds.any():
+            self.wrap(offset, pos_mod, out_of_bounds[:, 0], out_of_bounds[:, 1])
+
+        game.screen.draw_many(zip(self.images, pos_mod.tolist()))
+
+    def get_bytes(self):
+        return sum(images.get_image_bytes(x) for x in {id(x): x for x in self.images}.values())
+
+    def wrap(self, offset, pos_mod, out_x, out_y):
+        self.pos[out_x, 0] = offset[out_x, 0] + pos_mod[out_x, 0]
+        self.pos[out_y, 1] = offset[out_y, 1] + pos_mod[out_y, 1]
+
+        display_size = game.screen.display_size
+        for i in np.flatnonzero(self.rand & out_y):
+            self.pos[i, 0] = offset[i, 0] + random.random() * display_size[0]
+        for i in np.flatnonzero(self.rand & out_x & ~out_y):
+            self.pos[i, 1] = offset[i, 1] + random.random() * display_size[1]
+
+
 truespace_background_star_names = [assets.get_truespace_background_star(name) for name in [
     '010c', '010d', '010e', '012c', '012d', '012e', '019b', '019c', '020a', '020b', '021a', '021b'
 ]]
@@ -67,13 +104,14 @@ quasispace_background_star_names = [assets.get_quasispace_background_star(name)
 ]]
 
 
-def random_background_star(scale, dist, rand, name_list):
-    pos = np.array([random.random(), random.random()]) * game.screen.display_size
-    return BackgroundStar(random.choice(name_list), scale, pos, dist, rand)
+def random_background_star(scale, dist, rand, name_list, rng=random):
+    pos = np.array([rng.random(), rng.random()]) * game.screen.display_size
+    # Star scales are random, so each starfield scales its own copies instead of filling images.cache with one-off entries
+    return BackgroundStar(images.cache.get_source(rng.choice(name_list)), scale, pos, dist, rand)
 
 
-def random_truespace_background_star(scale, dist):
-    return random_background_star(scale, dist, False, truespace_background_star_names)
+def random_truespace_background_star(scale, dist, rng=random):
+    return random_background_star(scale, dist, False, truespace_background_star_names, rng)
 
 
 def random_hyperspace_background_star(scale, dist):
@@ -84,14 +122,14 @@ def random_quasispace_background_star(scale, dist):
     return random_background_star(scale, dist, True, quasispace_background_star_names)
 
 
-def random_minimap_background_star(scale, name_list):
+def random_minimap_background_star(scale, name_list, rng=random):
     minimap_rect = game.screen.minimap_rect
-    pos = np.array([minimap_rect.x, minimap_rect.y]) + np.array([random.random(), random.random()]) * np.array([minimap_rect.w, minimap_rect.h])
-    return HUDSprite(random.choice(name_list), scale, pos)
+    pos = np.array([minimap_rect.x, minimap_rect.y]) + np.array([rng.random(), rng.random()]) * np.array([minimap_rect.w, minimap_rect.h])
+    return HUDSprite(images.cache.get_source(rng.choice(name_list)), scale, pos)
 
 
-def random_truespace_minimap_background_star(scale):
-    return random_minimap_background_star(scale, truespace_background_star_names)
+def random_truespace_minimap_background_star(scale, rng=random):
+    return random_minimap_background_star(scale, truespace_background_star_names, rng)
 
 
 def random_hyperspace_minimap_background_star(scale):
@@ -0,0 +1,409 @@
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pygame as pg
+
+import assets
+import backgrounds
+import constants
+import data
+import engines
+import game
+import helpers
+import images
+import jit
+import maps
+import modes
+import search
+import spaces
+import vecs
+
+from engines import NPCEngine
+from fleets import Fleet
+from ships import InterceptShip
+
+
+def init_headless():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pg.init()
+    data.load()
+    jit.warm_up()
+    game.clock = pg.time.Clock()
+    game.screen = game.Screen()
+
+
+def clear_data():
+    data.systems.clear()
+    data.races.clear()
+    data.ships.clear()
+    data.thrusters.clear()
+
+
+def time_calls(func, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times, unit=1.0e3, unit_name='ms'):
+    best = unit * min(times)
+    mean = unit * sum(times) / len(times)
+    print(f'{name}: first {unit * times[0]:.3f} {unit_name}, best {best:.3f} {unit_name}, mean {mean:.3f} {unit_name}')
+
+
+def bench_data_load(repeat=5):
+    hashes = data.get_catalog_hashes()
+    report('data.load_text', time_calls(data.load_text, repeat, clear_data))
+
+    data.save_catalog_cache(hashes)
+    report('data.load_catalog_cache', time_calls(lambda: data.load_catalog_cache(hashes), repeat, clear_data))
+
+    report('data.get_catalog_hashes', time_calls(data.get_catalog_hashes, repeat))
+
+
+def bench_hyperspace_grid(repeat=200):
+    init_headless()
+    image = pg.Surface((16, 16))
+    display_size = game.screen.display_size
+
+    for count in (500, 5000, 50000):
+        random.seed(count)
+        hyperspace_map = maps.Map()
+        for i in range(count):
+            coords = np.array([random.uniform(0.0, 1000.0 * math.sqrt(count / 500.0)), random.uniform(0.0, 1000.0)])
+            hyperspace_map.elems.append(maps.HyperSpaceSystemElement(str(i), image, 1.0, coords, 0.0))
+        grid = maps.ElementGrid(hyperspace_map.elems, game.screen.display_max_dim)
+        cameras = [hyperspace_map.elems[random.randrange(count)].sprite.pos - 0.5 * display_size for _ in range(repeat)]
+
+        def linear():
+            for camera in cameras:
+                view = pg.Rect(camera, display_size)
+                [x for x in hyperspace_map.elems if x.sprite.rect.colliderect(view)]
+
+        def indexed():
+            for camera in cameras:
+                grid.query(camera[0], camera[1], camera[0] + display_size[0], camera[1] + display_size[1])
+
+        report(f'linear viewport query, {count} systems', time_calls(linear, 5), 1.0e6 / repeat, 'us')
+        report(f'grid viewport query, {count} systems', time_calls(indexed, 5), 1.0e6 / repeat, 'us')
+
+
+def bench_ship_rotation(repeat=1000):
+    init_headless()
+    image, _ = images.cache.get('../assets/images/ships/cruiser/hyperspace.png', 1.0)
+    rect = image.get_rect()
+    angles = [random.uniform(0.0, 2.0 * math.pi) for _ in range(repeat)]
+
+    def rotate(func):
+        def run():
+            for angle in angles:
+                func(image, rect, angle)
+        return run
+
+    report('helpers.rotate', time_calls(rotate(helpers.rotate), 5), 1.0e6 / repeat, 'us')
+    report('images.rotate', time_calls(rotate(images.rotate), 5), 1.0e6 / repeat, 'us')
+
+
+def bench_npc_collision(repeat=100):
+    init_headless()
+    race = data.races['Ilwrath']
+    image = assets.get_ship(race.ship_name.lower(), spaces.hyperspace)
+    ship_data = data.ships[race.ship_name]
+
+    def get_ship(pos, angle):
+        engine = NPCEngine(ship_data.thrust, ship_data.thrust, ship_data.thrust, ship_data.ang_thrust, 0.05, 0.05)
+        return InterceptShip(image, 1.0, pos, spaces.hyperspace, engine, ship_data.mass, ship_data.moi, ship_data.area, np.zeros(2), angle, 0.0, True)
+
+    player_ship = get_ship(np.zeros(2), 0.5)
+    for count in (1, 10, 100):
+        random.seed(count)
+        npc_ships = [get_ship(np.array([random.uniform(-8.0, 8.0), random.uniform(-8.0, 8.0)]), random.uniform(0.0, 2.0 * math.pi)) for _ in range(count)]
+
+        def collide(get_mask):
+            def run():
+                for _ in range(repeat):
+                    for npc_ship in npc_ships:
+                        if pg.sprite.collide_rect(player_ship, npc_ship):
+                            get_mask(player_ship.image).overlap(get_mask(npc_ship.image), npc_ship.pos - player_ship.pos)
+            return run
+
+        report(f'pg.mask.from_surface, {count} overlapping', time_calls(collide(pg.mask.from_surface), 5), 1.0e6 / repeat, 'us')
+        report(f'images.masks, {count} overlapping', time_calls(collide(images.masks.get), 5), 1.0e6 / repeat, 'us')
+
+
+def bench_starfield(repeat=100):
+    init_headless()
+    for count in (200, 2000):
+        random.seed(count)
+        sprites = [backgrounds.random_hyperspace_background_star(0.25 * (1.0 + random.random()), 0.5 * (1.0 + random.random())) for _ in range(count)]
+        starfield = backgrounds.Starfield(sprites)
+        cameras = [np.array([40.0 * i, -25.0 * i]) for i in range(repeat)]
+
+        def draw_sprites():
+            for camera in cameras:
+                for sprite in sprites:
+                    sprite.draw(camera)
+
+        def draw_starfield():
+            for camera in cameras:
+                starfield.draw(camera)
+
+        report(f'BackgroundSprite.draw, {count} stars', time_calls(draw_sprites, 5), 1.0e6 / repeat, 'us')
+        report(f'Starfield.draw, {count} stars', time_calls(draw_starfield, 5), 1.0e6 / repeat, 'us')
+
+
+def bench_orbit_layer(repeat=100):
+    init_headless()
+    for name in ('Sol', 'Beta Arae'):
+        system_map = maps.SolarSystemMap(name, 0)
+        cameras = [np.array([0.5 * system_map.half_width + 8.0 * i, -4.0 * i]) for i in range(repeat)]
+
+        def draw_ellipses():
+            for camera in cameras:
+                for elem in system_map.elems:
+                    elem.draw_orbit(game.screen.display, (-camera[0], -camera[1]))
+
+        def draw_layer():
+            for camera in cameras:
+                system_map.orbit_layer.draw(camera)
+
+        report(f'pg.draw.ellipse orbits, {name}', time_calls(draw_ellipses, 5), 1.0e6 / repeat, 'us')
+        report(f'OrbitLayer.draw, {name}', time_calls(draw_layer, 5), 1.0e6 / repeat, 'us')
+
+
+# The array implementation Engine.update_ship was written from, kept as the reference its integrate kernel is timed against
+def update_ship_array(engine, ship, space, lat_mult, long_mult, modifier1, modifier2, dt):
+    sideways = modifier1 and engine.side_thrust > 0.0
+    max_friction_mult = ship.mass / dt
+    max_ang_friction_mult = ship.moi / dt
+
+    sqrt_area = np.sqrt(ship.area)
+    vel_dir, speed = vecs.norm_tuple(ship.vel)
+    friction = (space.lin_mu1 * sqrt_area + space.lin_mu2 * ship.area * speed) * speed
+    max_friction = 0.5 * max_friction_mult * speed
+    if friction > max_friction:
+        friction = max_friction
+    perp_dir = np.array([-ship.dir[1], ship.dir[0]])
+    lat_thrust = np.zeros(2) if not sideways else lat_mult * engine.side_thrust * perp_dir
+    long_thrust = long_mult * (engine.forward_thrust if long_mult > 0.0 else engine.retro_thrust)
+    acc = (lat_thrust + long_thrust * ship.dir - friction * vel_dir) / ship.mass
+
+    ship.vel += dt * acc
+
+    area_3_2 = sqrt_area * ship.area
+    ang_speed, ang_vel_sign = abs(ship.ang_vel), 1.0 if ship.ang_vel > 0.0 else -1.0
+    ang_friction = (space.rot_mu1 * area_3_2 + space.rot_mu2 * area_3_2 * ship.area * ang_speed) * ang_speed
+    max_ang_friction = 0.5 * max_ang_friction_mult * ang_speed
+    if ang_friction > max_ang_friction:
+        ang_friction = max_ang_friction
+    ang_thrust = 0.0 if sideways else lat_mult * engine.ang_thrust
+    ang_acc = (ang_thrust - ang_vel_sign * ang_friction) / ship.moi
+
+    ship.ang_vel += dt * ang_acc
+
+    if modifier2:
+        if engine.damp_factor > 0.0:
+            vel_dir, speed = vecs.norm_tuple(ship.vel)
+            cos = np.dot(ship.dir, vel_dir)
+            damping = engine.retro_damping if cos > 0.0 else engine.forward_damping
+            sin_sq = 1.0 - cos * cos
+            damping += (np.sqrt(sin_sq) if sin_sq > 0.0 else 0.0) * engine.side_damping
+            if damping > max_friction_mult * speed:
+                ship.vel = np.zeros(2)
+            else:
+                ship.vel -= dt * damping / ship.mass * vel_dir
+
+        if engine.ang_damp_factor > 0.0:
+            ang_speed, ang_vel_sign = abs(ship.ang_vel), 1.0 if ship.ang_vel > 0.0 else -1.0
+            ang_damping = engine.ang_damping
+            if ang_damping > max_ang_friction_mult * ang_speed:
+                ship.ang_vel = 0.0
+            else:
+                ship.ang_vel -= dt * ang_vel_sign * ang_damping / ship.moi
+
+    ship.pos += ship.scale * dt * ship.vel
+    ship.angle += dt * ship.ang_vel
+    ship.angle = helpers.positive_fmod(ship.angle, constants.two_pi)
+
+
+def bench_engine(repeat=10000):
+    init_headless()
+    engine = engines.Engine(600.0, 100.0, 100.0, 500.0, 0.05, 0.05)
+
+    class BenchShip:
+        def __init__(self):
+            self.pos, self.vel = np.zeros(2), np.array([3.0, -4.0])
+            self.angle, self.ang_vel = 0.5, 0.1
+            self.dir = np.array([math.cos(self.angle), math.sin(self.angle)])
+            self.scale, self.mass, self.moi, self.area = 1.0, 10.0, 10.0, 1.0
+
+    def update(func):
+        ship = BenchShip()
+
+        def run():
+            for i in range(repeat):
+                func(ship, spaces.hyperspace, 1.0, 1.0, False, i % 2 == 0, 0.016)
+        return run
+
+    update(engine.update_ship)()
+    report('update_ship_array', time_calls(update(lambda *args: update_ship_array(engine, *args)), 5), 1.0e6 / repeat, 'us')
+    report('Engine.update_ship', time_calls(update(engine.update_ship), 5), 1.0e6 / repeat, 'us')
+
+
+def bench_fleet(repeat=20):
+    init_headless()
+    race = data.races['Ilwrath']
+    image = assets.get_ship(race.ship_name.lower(), spaces.hyperspace)
+    ship_data = data.ships[race.ship_name]
+    thrust, ang_thrust = ship_data.thrust, ship_data.ang_thrust
+    target_pos = np.zeros(2)
+
+    for count in (100, 1000, 5000):
+        random.seed(count)
+        ships = []
+        for _ in range(count):
+            engine = NPCEngine(0.8 * thrust, 0.1 * thrust, 0.1 * thrust, ang_thrust, 0.05, 0.05)
+            pos = np.array([random.uniform(-2000.0, 2000.0), random.uniform(-2000.0, 2000.0)])
+            ships.append(InterceptShip(image, 1.0, pos, spaces.hyperspace, engine, ship_data.mass, ship_data.moi, ship_data.area, np.zeros(2), random.uniform(0.0, 2.0 * math.pi), 0.0, False))
+        fleet = Fleet(spaces.hyperspace)
+
+        def update_ships():
+            for _ in range(repeat):
+                for ship in ships:
+                    ship.update(None, target_pos, 0.016)
+
+        def update_fleet():
+            for _ in range(repeat):
+                fleet.update(target_pos, 0.016)
+                fleet.get_visible(target_pos - 0.5 * game.screen.display_size)
+
+        report(f'InterceptShip.update, {count} ships', time_calls(update_ships, 3), 1.0e3 / repeat)
+        for ship in ships:
+            fleet.add(ship)
+        report(f'Fleet.update, {count} ships', time_calls(update_fleet, 3), 1.0e3 / repeat)
+
+
+def bench_ephemeris(repeat=1000):
+    init_headless()
+    for name in ('Sol', 'Beta Arae'):
+        system = data.systems[name]
+        times = [0.01 * i for i in range(repeat)]
+
+        def evaluate_scalar():
+            for t in times:
+                for planet in system.planets:
+                    planet.initial_angle + 0.0172017 * t * math.sqrt(system.mass / (planet.orbit * planet.orbit * planet.orbit))
+                    for moon in planet.moons:
+                        moon.initial_angle + 971.903 * t * math.sqrt(planet.mass / (moon.orbit * moon.orbit * moon.orbit))
+
+        def evaluate_ephemeris():
+            ephemeris = data.get_ephemeris(system)
+            for t in times:
+                ephemeris.get_angles(t)
+
+        system_map = maps.SolarSystemMap(name, 0.0)
+
+        def set_time():
+            for t in times:
+                system_map.set_time(t)
+
+        report(f'scalar orbit angles, {name}', time_calls(evaluate_scalar, 5), 1.0e6 / repeat, 'us')
+        report(f'Ephemeris orbit angles, {name}', time_calls(evaluate_ephemeris, 5), 1.0e6 / repeat, 'us')
+        report(f'SolarSystemMap.set_time, {name}', time_calls(set_time, 5), 1.0e6 / repeat, 'us')
+        report(f'SolarSystemMap rebuild, {name}', time_calls(lambda: maps.SolarSystemMap(name, 1.0), 5))
+
+
+def bench_search(repeat=200):
+    random.seed(0)
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    words = [''.join(random.choice(letters) for _ in range(random.randint(3, 9))) for _ in range(2000)]
+    names = {f'{random.choice(words)} {random.choice(words)}' for _ in range(100000)}
+    name_list = sorted(names)
+    texts = [x[:random.randint(1, len(x))] for x in random.sample(name_list, repeat)]
+    texts.extend(f'{x} {random.choice(("IV", "3", "II-B"))}' for x in random.sample(name_list, repeat))
+
+    def complete_scan():
+        for text in texts:
+            helpers.auto_complete(text, names)
+            helpers.contained_prefix(text, names)
+
+    index = None
+
+    def build_index():
+        nonlocal index
+        index = search.PrefixIndex(names)
+
+    def complete_index():
+        for text in texts:
+            index.auto_complete(text)
+            index.contained_prefix(text)
+
+    report(f'helpers.auto_complete + contained_prefix, {len(names)} names', time_calls(complete_scan, 3), 1.0e6 / len(texts), 'us')
+    report(f'PrefixIndex build, {len(names)} names', time_calls(build_index, 3))
+    report(f'PrefixIndex.auto_complete + contained_prefix, {len(names)} names', time_calls(complete_index, 5), 1.0e6 / len(texts), 'us')
+
+    def typo(name):
+        i = random.randrange(len(name))
+        return f'{name[:i]}{random.choice(letters)}{name[i + 1:]}'
+
+    pos = np.array([[random.uniform(0.0, 1.0e6), random.uniform(0.0, 1.0e6)] for _ in name_list])
+    typo_texts = [typo(x) for x in random.sample(name_list, repeat)]
+    fuzzy_index = None
+
+    def build_fuzzy_index():
+        nonlocal fuzzy_index
+        fuzzy_index = search.FuzzyIndex(name_list, pos)
+
+    def query_fuzzy_index():
+        for text in typo_texts:
+            fuzzy_index.query(text, 5, pos[0])
+
+    report(f'FuzzyIndex build, {len(names)} names', time_calls(build_fuzzy_index, 1), 1.0, 's')
+    report(f'FuzzyIndex.query, {len(names)} names', time_calls(query_fuzzy_index, 5), 1.0e6 / len(typo_texts), 'us')
+
+
+def bench_scene_cache(repeat=5):
+    init_headless()
+    game.instance.time = 0.0
+    for name in ('Sol', 'Beta Arae'):
+        def build():
+            modes.solar_system_scenes.clear()
+            modes.get_solar_system_scene(name)
+
+        def reuse():
+            game.instance.time += 1.0
+            modes.get_solar_system_scene(name)
+
+        report(f'SolarSystemScene build, {name}', time_calls(build, repeat))
+        report(f'SolarSystemScene reuse, {name}', time_calls(reuse, repeat))
+    print(modes.solar_system_scenes.get_stats())
+
+
+benchmarks = {
+    'data_load': bench_data_load,
+    'hyperspace_grid': bench_hyperspace_grid,
+    'ship_rotation': bench_ship_rotation,
+    'npc_collision': bench_npc_collision,
+    'starfield': bench_starfield,
+    'orbit_layer': bench_orbit_layer,
+    'engine': bench_engine,
+    'fleet': bench_fleet,
+    'ephemeris': bench_ephemeris,
+    'search': bench_search,
+    'scene_cache': bench_scene_cache,
+}
+
+
+if __name__ == '__main__':
+    for bench_name in sys.argv[1:] or benchmarks.keys():
+        benchmarks[bench_name]()
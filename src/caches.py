@@ -0,0 +1,95 @@
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    # The budget is soft: entries that can_evict holds on to, and the newest entry, are kept even when over it
+    def __init__(self, budget, get_bytes, can_evict=None):
+        self.budget = budget
+        self.get_bytes = get_bytes
+        self.can_evict = can_evict
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The prefetch worker checks the image cache, and sprites can be collected and release their images, on other threads
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.set_last(key)
+            return value
+
+    def add(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                del self.entries[key]
+                self.bytes -= self.sizes.pop(key)
+            self.set_last(key)
+            self.entries[key] = value
+            self.sizes[key] = self.get_bytes(value)
+            self.bytes += self.sizes[key]
+            self.evict()
+            return value
+
+    def set_last(self, key):
+        # Entries grow while in use (lazily built tiles and layers), and only the most recently used one is in use,
+        # so it is measured again once another entry takes its place
+        last = next(reversed(self.entries), None)
+        if last is not None and last != key:
+            self.measure(last)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+
+    def measure(self, key):
+        size = self.get_bytes(self.entries[key])
+        self.bytes += size - self.sizes[key]
+        self.sizes[key] = size
+
+    def evict(self):
+        with self.lock:
+            if self.bytes <= self.budget:
+                return
+            # The newest entry is kept, since whoever added it has not had the chance to use it yet
+            for key in list(self.entries)[:-1]:
+                if self.bytes <= self.budget:
+                    break
+                if self.can_evict is not None and not self.can_evict(key):
+                    continue
+                del self.entries[key]
+                self.bytes -= self.sizes.pop(key)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            last = next(reversed(self.entries), None)
+            if last is not None:
+                self.measure(last)
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -1,13 +1,21 @@
+import gc
+import hashlib
 import math
+import os
+import pickle
+import threading
 
 import numpy as np
 
 import assets
 import helpers
+import search
 import spaces
 
+from collections.abc import Sequence
 from dataclasses import dataclass
 from helpers import MinMax
+from search import FuzzyIndex, PrefixIndex
 from thrusters import Thruster
 from typing import Any
 
@@ -22,9 +30,10 @@ class SystemData:
     radius: float
     luminosity: float
     mass: float
-    planets: list
+    planets: 'LazyPlanetList'
     planet_orbit_mm: MinMax
     planet_radius_mm: MinMax
+    id: int
 
 
 @dataclass
@@ -145,8 +154,50 @@ def parse_planet_data(data, system_name, is_moon):
     )
 
 
+planet_parse_lock = threading.Lock()
+
+
+class LazyPlanetList(Sequence):
+    def __init__(self, planet_data):
+        self.system = None
+        self.segments = planet_data.split('||') if planet_data else []
+        self.planets = None
+
+    def __getstate__(self):
+        return self.system, self.segments
+
+    def __setstate__(self, state):
+        self.system, self.segments = state
+        self.planets = None
+
+    def is_parsed(self):
+        return self.planets is not None
+
+    def parse(self):
+        if self.planets is None:
+            with planet_parse_lock:
+                if self.planets is None:
+                    planets = [parse_planet_data(data, self.system.name, False) for data in self.segments]
+                    for p in planets:
+                        p.system = self.system
+                        for m in p.moons:
+                            m.system = p
+                    self.planets = planets
+        return self.planets
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __getitem__(self, index):
+        return self.parse()[index]
+
+    def __iter__(self):
+        return iter(self.parse())
+
+
 systems = {}
 system_search_names: set
+system_search_index = None
 
 
 def load_systems():
@@ -159,20 +210,17 @@ def load_systems():
         radius = float(parts[6])
         luminosity = float(parts[7])
         mass = float(parts[8])
-        planet_data = parts[9]
-        planets = []
+        planets = LazyPlanetList(parts[9])
         planet_orbit_mm = MinMax()
         planet_radius_mm = MinMax()
         planet_orbit_mm.update(0.025 * math.sqrt(radius))
         planet_radius_mm.update(0.16)
-        if planet_data:
-            for data in planet_data.split('||'):
-                planet = parse_planet_data(data, name, False)
-                planets.append(planet)
-                planet_orbit_mm.update(planet.orbit)
-                planet_radius_mm.update(planet.radius)
-
-        systems[name] = SystemData(
+        for data in planets.segments:
+            planet_parts = data.split('??', 10)
+            planet_orbit_mm.update(float(planet_parts[3]))
+            planet_radius_mm.update(float(planet_parts[9]))
+
+        system = SystemData(
             name,
             coords,
             color,
@@ -184,7 +232,10 @@ def load_systems():
             planets,
             planet_orbit_mm,
             planet_radius_mm,
+            len(systems),
         )
+        planets.system = system
+        systems[name] = system
 
     with open(assets.get_data('systems')) as file:
         lines = file.readlines()
@@ -193,14 +244,131 @@ def load_systems():
             if len(line) > 0:
                 add_system(line.split('&&'))
 
-    for s in systems.values():
-        for p in s.planets:
-            p.system = s
-            for m in p.moons:
-                m.system = p
-
-    global system_search_names
+    global system_search_names, system_search_index
     system_search_names = {x.upper() for x in systems.keys()}
+    system_search_index = None
+
+
+def get_system_search_index():
+    global system_search_index
+    if system_search_index is None:
+        system_search_index = PrefixIndex(system_search_names)
+    return system_search_index
+
+
+system_colors = ['r', 'o', 'y', 'g', 'w', 'b']
+system_color_codes = {v: k for k, v in enumerate(system_colors)}
+
+system_sizes = ['s', 'm', 'l']
+system_size_codes = {v: k for k, v in enumerate(system_sizes)}
+
+
+@dataclass
+class SystemTable:
+    names: list
+    coords: np.ndarray
+    pos: np.ndarray
+    radius: np.ndarray
+    luminosity: np.ndarray
+    mass: np.ndarray
+    temperature: np.ndarray
+    color: np.ndarray
+    size: np.ndarray
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_system(self, system_id):
+        return systems[self.names[system_id]]
+
+    def distances(self, pos):
+        return np.hypot(self.pos[:, 0] - pos[0], self.pos[:, 1] - pos[1])
+
+    def within(self, pos, radius):
+        return np.flatnonzero(self.distances(pos) <= radius)
+
+    def nearest(self, pos, count=1):
+        dists = self.distances(pos)
+        if count >= len(dists):
+            return np.argsort(dists)
+        ids = np.argpartition(dists, count)[:count]
+        return ids[np.argsort(dists[ids])]
+
+
+system_table: SystemTable
+system_fuzzy_index = None
+
+
+def load_system_table():
+    system_list = sorted(systems.values(), key=lambda x: x.id)
+    coords = np.array([x.coords for x in system_list], dtype=np.float64).reshape(-1, 2)
+
+    global system_table, system_fuzzy_index
+    system_fuzzy_index = None
+    system_table = SystemTable(
+        [x.name for x in system_list],
+        coords,
+        helpers.coords_to_pos_array(coords),
+        np.array([x.radius for x in system_list], dtype=np.float64),
+        np.array([x.luminosity for x in system_list], dtype=np.float64),
+        np.array([x.mass for x in system_list], dtype=np.float64),
+        np.array([x.temperature for x in system_list], dtype=np.float64),
+        np.array([system_color_codes[x.color] for x in system_list], dtype=np.int8),
+        np.array([system_size_codes[x.size] for x in system_list], dtype=np.int8),
+    )
+
+
+planet_motion_constant = 0.0172017
+moon_motion_constant = 971.903
+
+
+@dataclass
+class Ephemeris:
+    initial_angles: np.ndarray
+    motion_constants: np.ndarray
+    rates: np.ndarray
+    moon_offsets: np.ndarray
+
+    def get_angles(self, time):
+        return self.initial_angles + self.motion_constants * time * self.rates
+
+    def get_planet_slice(self):
+        return slice(0, self.moon_offsets[0])
+
+    def get_moon_slice(self, planet_number):
+        return slice(self.moon_offsets[planet_number - 1], self.moon_offsets[planet_number])
+
+
+ephemerides = {}
+ephemeris_lock = threading.Lock()
+
+
+def get_ephemeris(system):
+    ephemeris = ephemerides.get(system.name)
+    if ephemeris is None:
+        # The prefetch worker computes ephemerides for the systems ahead while the main thread uses them
+        with ephemeris_lock:
+            ephemeris = ephemerides.get(system.name)
+            if ephemeris is None:
+                planets = system.planets
+                moons = [m for p in planets for m in p.moons]
+                orbits = np.array([x.orbit for x in planets] + [m.orbit for m in moons], dtype=np.float64)
+                masses = np.array([system.mass] * len(planets) + [p.mass for p in planets for _ in p.moons], dtype=np.float64)
+                ephemeris = Ephemeris(
+                    np.array([x.initial_angle for x in planets] + [m.initial_angle for m in moons], dtype=np.float64),
+                    np.array([planet_motion_constant] * len(planets) + [moon_motion_constant] * len(moons), dtype=np.float64),
+                    np.sqrt(masses / (orbits * orbits * orbits)),
+                    len(planets) + np.cumsum([0] + [len(p.moons) for p in planets]),
+                )
+                ephemerides[system.name] = ephemeris
+    return ephemeris
+
+
+def get_system_fuzzy_index():
+    global system_fuzzy_index
+    if system_fuzzy_index is None:
+        system_fuzzy_index = FuzzyIndex([x.upper() for x in system_table.names], system_table.pos)
+    return system_fuzzy_index
 
 
 @dataclass
@@ -310,9 +478,80 @@ def load_dynamos():
     pass
 
 
-def load():
+catalog_version = 3
+catalog_sources = ['systems', 'races', 'ships', 'thrusters']
+
+
+def get_catalog_hashes():
+    hashes = {}
+    for name in catalog_sources:
+        with open(assets.get_data(name), 'rb') as file:
+            hashes[name] = hashlib.sha1(file.read()).hexdigest()
+    return hashes
+
+
+def load_catalog_cache(hashes):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(assets.get_cache('catalog'), 'rb') as file:
+            header = pickle.load(file)
+            if header != (catalog_version, hashes):
+                return False
+            catalog = pickle.load(file)
+        cached = catalog['systems'], catalog['races'], catalog['ships'], catalog['thrusters']
+    except Exception:
+        # A missing, stale or corrupt cache of any kind is rebuilt from the text files
+        return False
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    for catalog_dict, cached_dict in zip((systems, races, ships, thrusters), cached):
+        catalog_dict.update(cached_dict)
+
+    global system_search_names, system_search_index, race_list
+    system_search_names = {x.upper() for x in systems.keys()}
+    system_search_index = None
+    race_list = [x for x in races.values()]
+    return True
+
+
+def save_catalog_cache(hashes):
+    path = assets.get_cache('catalog')
+    catalog = {
+        'systems': systems,
+        'races': races,
+        'ships': ships,
+        'thrusters': thrusters,
+    }
+
+    try:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(f'{path}.tmp', 'wb') as file:
+            pickle.dump((catalog_version, hashes), file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(catalog, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{path}.tmp', path)
+    except EnvironmentError:
+        pass
+
+
+def load_text():
     load_systems()
     load_races()
     load_ships()
     load_thrusters()
+
+
+def load():
+    ephemerides.clear()
+    # Prefix indexes are built from the catalog, so a reload has to rebuild them
+    search.indices.clear()
+    hashes = get_catalog_hashes()
+    if not load_catalog_cache(hashes):
+        load_text()
+        save_catalog_cache(hashes)
+    load_system_table()
     load_dynamos()
@@ -1,9 +1,83 @@
+import math
 import numpy as np
 
 import constants
 import game
-import helpers
-import vecs
+import jit
+
+
+@jit.njit('float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, float64, '
+          'float64, float64, float64, float64, float64, float64, float64, float64, '
+          'float64, float64, float64, float64, float64, float64, '
+          'float64, float64, boolean, boolean, float64, float64[:, ::1]')
+def integrate(pos_x, pos_y, vel_x, vel_y, angle, ang_vel, dir_x, dir_y, scale, mass, moi, area,
+              lin_mu1, lin_mu2, rot_mu1, rot_mu2, forward_thrust, retro_thrust, side_thrust, ang_thrust,
+              damp_factor, ang_damp_factor, forward_damping, retro_damping, side_damping, ang_damping,
+              lat_mult, long_mult, modifier1, modifier2, dt, work):
+    # The norm and dot product go through the same BLAS routines as the array implementation in benchmarks.py
+    sideways = modifier1 and side_thrust > 0.0
+    max_friction_mult = mass / dt
+    max_ang_friction_mult = moi / dt
+
+    sqrt_area = math.sqrt(area)
+    work[0, 0], work[0, 1] = vel_x, vel_y
+    speed = np.linalg.norm(work[0])
+    vel_dir_x, vel_dir_y = (vel_x, vel_y) if speed == 0.0 else (vel_x / speed, vel_y / speed)
+    friction = (lin_mu1 * sqrt_area + lin_mu2 * area * speed) * speed
+    max_friction = 0.5 * max_friction_mult * speed
+    if friction > max_friction:
+        friction = max_friction
+    lat_thrust_x, lat_thrust_y = (0.0, 0.0) if not sideways else (lat_mult * side_thrust * -dir_y, lat_mult * side_thrust * dir_x)
+    long_thrust = long_mult * (forward_thrust if long_mult > 0.0 else retro_thrust)
+    acc_x = (lat_thrust_x + long_thrust * dir_x - friction * vel_dir_x) / mass
+    acc_y = (lat_thrust_y + long_thrust * dir_y - friction * vel_dir_y) / mass
+
+    vel_x += dt * acc_x
+    vel_y += dt * acc_y
+
+    area_3_2 = sqrt_area * area
+    ang_speed, ang_vel_sign = abs(ang_vel), 1.0 if ang_vel > 0.0 else -1.0
+    ang_friction = (rot_mu1 * area_3_2 + rot_mu2 * area_3_2 * area * ang_speed) * ang_speed
+    max_ang_friction = 0.5 * max_ang_friction_mult * ang_speed
+    if ang_friction > max_ang_friction:
+        ang_friction = max_ang_friction
+    ang_acc = ((0.0 if sideways else lat_mult * ang_thrust) - ang_vel_sign * ang_friction) / moi
+
+    ang_vel += dt * ang_acc
+
+    if modifier2:
+        if damp_factor > 0.0:
+            work[0, 0], work[0, 1] = vel_x, vel_y
+            speed = np.linalg.norm(work[0])
+            vel_dir_x, vel_dir_y = (vel_x, vel_y) if speed == 0.0 else (vel_x / speed, vel_y / speed)
+            work[0, 0], work[0, 1] = dir_x, dir_y
+            work[1, 0], work[1, 1] = vel_dir_x, vel_dir_y
+            cos = np.dot(work[0], work[1])
+            damping = retro_damping if cos > 0.0 else forward_damping
+            sin_sq = 1.0 - cos * cos
+            damping += (math.sqrt(sin_sq) if sin_sq > 0.0 else 0.0) * side_damping
+            if damping > max_friction_mult * speed:
+                vel_x, vel_y = 0.0, 0.0
+            else:
+                vel_x -= dt * damping / mass * vel_dir_x
+                vel_y -= dt * damping / mass * vel_dir_y
+
+        if ang_damp_factor > 0.0:
+            ang_speed, ang_vel_sign = abs(ang_vel), 1.0 if ang_vel > 0.0 else -1.0
+            if ang_damping > max_ang_friction_mult * ang_speed:
+                ang_vel = 0.0
+            else:
+                ang_vel -= dt * ang_vel_sign * ang_damping / moi
+
+    pos_x += scale * dt * vel_x
+    pos_y += scale * dt * vel_y
+    angle += dt * ang_vel
+    angle = np.fmod(np.fmod(angle, constants.two_pi) + constants.two_pi, constants.two_pi)
+
+    return pos_x, pos_y, vel_x, vel_y, angle, ang_vel
+
+
+integrate_work = np.empty((2, 2))
 
 
 class Engine:
@@ -28,57 +102,13 @@ class Engine:
         self.ang_damping = self.damp_factor * self.ang_thrust
 
     def update_ship(self, ship, space, lat_mult, long_mult, modifier1, modifier2, dt):
-        sideways = modifier1 and self.side_thrust > 0.0
-        max_friction_mult = ship.mass / dt
-        max_ang_friction_mult = ship.moi / dt
-
-        sqrt_area = np.sqrt(ship.area)
-        vel_dir, speed = vecs.norm_tuple(ship.vel)
-        friction = (space.lin_mu1 * sqrt_area + space.lin_mu2 * ship.area * speed) * speed
-        max_friction = 0.5 * max_friction_mult * speed
-        if friction > max_friction:
-            friction = max_friction
-        perp_dir = np.array([-ship.dir[1], ship.dir[0]])
-        lat_thrust = np.zeros(2) if not sideways else lat_mult * self.side_thrust * perp_dir
-        long_thrust = long_mult * (self.forward_thrust if long_mult > 0.0 else self.retro_thrust)
-        acc = (lat_thrust + long_thrust * ship.dir - friction * vel_dir) / ship.mass
-
-        ship.vel += dt * acc
-
-        area_3_2 = sqrt_area * ship.area
-        ang_speed, ang_vel_sign = abs(ship.ang_vel), 1.0 if ship.ang_vel > 0.0 else -1.0
-        ang_friction = (space.rot_mu1 * area_3_2 + space.rot_mu2 * area_3_2 * ship.area * ang_speed) * ang_speed
-        max_ang_friction = 0.5 * max_ang_friction_mult * ang_speed
-        if ang_friction > max_ang_friction:
-            ang_friction = max_ang_friction
-        ang_thrust = 0.0 if sideways else lat_mult * self.ang_thrust
-        ang_acc = (ang_thrust - ang_vel_sign * ang_friction) / ship.moi
-
-        ship.ang_vel += dt * ang_acc
-
-        if modifier2:
-            if self.damp_factor > 0.0:
-                vel_dir, speed = vecs.norm_tuple(ship.vel)
-                cos = np.dot(ship.dir, vel_dir)
-                damping = self.retro_damping if cos > 0.0 else self.forward_damping
-                sin_sq = 1.0 - cos * cos
-                damping += (np.sqrt(sin_sq) if sin_sq > 0.0 else 0.0) * self.side_damping
-                if damping > max_friction_mult * speed:
-                    ship.vel = np.zeros(2)
-                else:
-                    ship.vel -= dt * damping / ship.mass * vel_dir
-
-            if self.ang_damp_factor > 0.0:
-                ang_speed, ang_vel_sign = abs(ship.ang_vel), 1.0 if ship.ang_vel > 0.0 else -1.0
-                ang_damping = self.ang_damping
-                if ang_damping > max_ang_friction_mult * ang_speed:
-                    ship.ang_vel = 0.0
-                else:
-                    ship.ang_vel -= dt * ang_vel_sign * ang_damping / ship.moi
-
-        ship.pos += ship.scale * dt * ship.vel
-        ship.angle += dt * ship.ang_vel
-        ship.angle = helpers.positive_fmod(ship.angle, constants.two_pi)
+        pos, vel = ship.pos, ship.vel
+        pos[0], pos[1], vel[0], vel[1], ship.angle, ship.ang_vel = integrate(
+            pos[0], pos[1], vel[0], vel[1], ship.angle, ship.ang_vel, ship.dir[0], ship.dir[1], ship.scale, ship.mass, ship.moi, ship.area,
+            space.lin_mu1, space.lin_mu2, space.rot_mu1, space.rot_mu2, self.forward_thrust, self.retro_thrust, self.side_thrust, self.ang_thrust,
+            self.damp_factor, self.ang_damp_factor, self.forward_damping, self.retro_damping, self.side_damping, self.ang_damping,
+            lat_mult, long_mult, modifier1, modifier2, dt, integrate_work,
+        )
 
 
 class PlayerEngine(Engine):
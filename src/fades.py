@@ -5,6 +5,7 @@ from pygame import Surface
 
 class Fade:
     def __init__(self, color, time):
+        self.color = color
         self.surface = Surface(game.screen.display_size)
         self.surface.fill(color)
         self.time = time
@@ -12,6 +13,11 @@ class Fade:
 
     def update(self, dt):
         if self.counter > 0.0:
-            self.surface.set_alpha(int(255.0 * self.counter / self.time))
-            game.screen.draw(self.surface, (0, 0))
+            alpha = int(255.0 * self.counter / self.time)
+            if alpha >= 255:
+                # An opaque fade hides everything, and filling is far cheaper than a full-alpha blit
+                game.screen.display.fill(self.color)
+            else:
+                self.surface.set_alpha(alpha)
+                game.screen.draw(self.surface, (0, 0))
             self.counter -= dt
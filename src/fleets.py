@@ -0,0 +1,157 @@
+import math
+import numpy as np
+
+import constants
+import engines
+import game
+import jit
+
+
+@jit.njit('int64, float64, float64, float64[:, ::1], float64[:, ::1], float64[::1], float64[::1], float64[:, ::1], float64[:, ::1], float64[:, ::1], '
+          'float64, float64, float64, float64, float64, float64[:, ::1]')
+def step_intercept(count, target_x, target_y, pos, vel, angle, ang_vel, direction, body, engine,
+                   lin_mu1, lin_mu2, rot_mu1, rot_mu2, dt, work):
+    for i in range(count):
+        diff_x, diff_y = target_x - pos[i, 0], target_y - pos[i, 1]
+        norm = math.hypot(diff_x, diff_y)
+        if norm > 0.0:
+            diff_x, diff_y = diff_x / norm, diff_y / norm
+        mult = 0.5 + 0.5 * (diff_x * math.cos(angle[i]) + diff_y * math.sin(angle[i]))
+        mult **= 24.0
+        target_angle = np.fmod(np.fmod(math.atan2(diff_y, diff_x), constants.two_pi) + constants.two_pi, constants.two_pi)
+        angle_diff = np.fmod(constants.two_pi + target_angle - angle[i], constants.two_pi)
+        lat_mult = 1.0 - mult if angle_diff < math.pi else mult - 1.0
+
+        pos[i, 0], pos[i, 1], vel[i, 0], vel[i, 1], angle[i], ang_vel[i] = engines.integrate(
+            pos[i, 0], pos[i, 1], vel[i, 0], vel[i, 1], angle[i], ang_vel[i], direction[i, 0], direction[i, 1],
+            body[i, 0], body[i, 1], body[i, 2], body[i, 3], lin_mu1, lin_mu2, rot_mu1, rot_mu2,
+            engine[i, 0], engine[i, 1], engine[i, 2], engine[i, 3], engine[i, 4],
+            engine[i, 5], engine[i, 6], engine[i, 7], engine[i, 8], engine[i, 9],
+            lat_mult, mult, False, True, dt, work,
+        )
+        direction[i, 0], direction[i, 1] = math.cos(angle[i]), math.sin(angle[i])
+
+
+class Fleet:
+    array_names = ('pos', 'prev_pos', 'vel', 'angle', 'prev_angle', 'ang_vel', 'dir', 'body', 'engine', 'extent')
+
+    def __init__(self, space, capacity=64):
+        self.space = space
+        self.ships = []
+        self.pos = np.zeros((capacity, 2))
+        self.prev_pos = np.zeros((capacity, 2))
+        self.vel = np.zeros((capacity, 2))
+        self.angle = np.zeros(capacity)
+        self.prev_angle = np.zeros(capacity)
+        self.ang_vel = np.zeros(capacity)
+        self.dir = np.zeros((capacity, 2))
+        self.body = np.zeros((capacity, 4))
+        self.engine = np.zeros((capacity, 10))
+        self.extent = np.zeros(capacity)
+        self.work = np.empty((2, 2))
+
+    def __len__(self):
+        return len(self.ships)
+
+    def __iter__(self):
+        return iter(list(self.ships))
+
+    def set_views(self, index):
+        ship = self.ships[index]
+        ship.fleet_index = index
+        ship.pos = self.pos[index]
+        ship.vel = self.vel[index]
+
+    def grow(self):
+        capacity = 2 * len(self.pos)
+        for name in self.array_names:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:])
+            new[:len(old)] = old
+            setattr(self, name, new)
+        for index in range(len(self.ships)):
+            self.set_views(index)
+
+    def add(self, ship):
+        if len(self.ships) == len(self.pos):
+            self.grow()
+
+        index = len(self.ships)
+        e = ship.engine
+        self.pos[index] = self.prev_pos[index] = ship.pos
+        self.vel[index] = ship.vel
+        self.angle[index] = self.prev_angle[index] = ship.angle
+        self.ang_vel[index] = ship.ang_vel
+        self.dir[index] = math.cos(ship.angle), math.sin(ship.angle)
+        self.body[index] = ship.scale, ship.mass, ship.moi, ship.area
+        self.engine[index] = (e.forward_thrust, e.retro_thrust, e.side_thrust, e.ang_thrust, e.damp_factor,
+                              e.ang_damp_factor, e.forward_damping, e.retro_damping, e.side_damping, e.ang_damping)
+        self.extent[index] = 0.5 * math.hypot(*ship.base_image.get_size())
+
+        self.ships.append(ship)
+        self.set_views(index)
+
+    def remove(self, ship):
+        index = getattr(ship, 'fleet_index', None)
+        if index is None or index >= len(self.ships) or self.ships[index] is not ship:
+            return
+
+        last = len(self.ships) - 1
+        ship.pos, ship.vel = ship.pos.copy(), ship.vel.copy()
+        ship.angle, ship.ang_vel = float(self.angle[index]), float(self.ang_vel[index])
+        ship.prev_pos = ship.prev_angle = None
+        ship.fleet_index = None
+
+        if index != last:
+            for name in self.array_names:
+                array = getattr(self, name)
+                array[index] = array[last]
+            self.ships[index] = self.ships[last]
+            self.set_views(index)
+        self.ships.pop()
+
+    def store_prev(self):
+        count = len(self.ships)
+        self.prev_pos[:count] = self.pos[:count]
+        self.prev_angle[:count] = self.angle[:count]
+
+    def update(self, target_pos, dt):
+        self.store_prev()
+        space = self.space
+        step_intercept(len(self.ships), target_pos[0], target_pos[1], self.pos, self.vel, self.angle, self.ang_vel, self.dir,
+                       self.body, self.engine, space.lin_mu1, space.lin_mu2, space.rot_mu1, space.rot_mu2, dt, self.work)
+
+    def get_distances(self, pos):
+        count = len(self.ships)
+        return np.hypot(self.pos[:count, 0] - pos[0], self.pos[:count, 1] - pos[1])
+
+    def cull(self, pos, radius):
+        for index in np.flatnonzero(self.get_distances(pos) > radius)[::-1]:
+            self.remove(self.ships[index])
+
+    def sync(self, indices):
+        ships = []
+        for index in indices:
+            ship = self.ships[index]
+            ship.angle, ship.ang_vel = float(self.angle[index]), float(self.ang_vel[index])
+            ship.prev_pos, ship.prev_angle = self.prev_pos[index], float(self.prev_angle[index])
+            ship.dir = self.dir[index].copy()
+            ship.set_rect()
+            ships.append(ship)
+        return ships
+
+    def get_visible(self, camera):
+        count = len(self.ships)
+        extent = self.extent[:count]
+        display_size = game.screen.display_size
+        x, y = self.pos[:count, 0] - camera[0], self.pos[:count, 1] - camera[1]
+        visible = (x > -extent) & (x < display_size[0] + extent) & (y > -extent) & (y < display_size[1] + extent)
+        return self.sync(np.flatnonzero(visible))
+
+    def get_nearby(self, pos, radius):
+        count = len(self.ships)
+        return self.sync(np.flatnonzero(self.get_distances(pos) < radius + self.extent[:count]))
+
+    def draw(self, camera, alpha):
+        for ship in self.get_visible(camera):
+            ship.draw_interpolated(camera, alpha)
@@ -5,18 +5,21 @@ import pygame as pg
 
 import data
 import helpers
+import profiler
+import replays
+import startup
 
 from pygame import Rect
 from pygame.font import SysFont
 from pygame.time import Clock
-from modes import HyperSpaceMode, SolarSystemMode, PlanetarySystemMode
+from modes import HyperSpaceMode, SolarSystemMode, PlanetarySystemMode, solar_system_prefetcher
 from player import Player
 from sprites import Sprite, HUDSprite
 
 
 class Screen:
-    def __init__(self):
-        self.display = pg.display.set_mode((0, 0))
+    def __init__(self, size=(0, 0)):
+        self.display = pg.display.set_mode(size)
         self.display_rect = self.display.get_rect()
         self.display_width = float(self.display.get_width())
         self.display_height = float(self.display.get_height())
@@ -40,6 +43,9 @@ class Screen:
     def draw(self, source, dest):
         self.display.blit(source, dest)
 
+    def draw_many(self, blit_sequence):
+        self.display.blits(blit_sequence, doreturn=False)
+
 
 class Game:
     def __init__(self):
@@ -57,25 +63,68 @@ instance = Game()
 pause_sprite: Sprite
 search_sprite: Sprite
 search_font: SysFont
+suggestion_font: SysFont
+
+tick_rate = 120.0
+time_scale = 0.001
+max_catch_up_steps = 8
+frame_rate_limit = 0
+build_budget_ms = 4.0
+
+
+def advance(mode, pressed_keys, accumulator, step_dt):
+    accumulator = min(accumulator, max_catch_up_steps * step_dt)
+    while accumulator >= step_dt:
+        accumulator -= step_dt
+        new_mode = mode.step(pressed_keys, step_dt)
+        if new_mode is not mode:
+            return new_mode, 0.0, 1.0
+    return mode, accumulator, accumulator / step_dt
+
+
+def run_frame(dt, events, pressed_keys, accumulator):
+    for event in events:
+        if event.type == pg.KEYDOWN and event.key == pg.K_F3:
+            profiler.toggle_overlay()
+        else:
+            instance.mode = instance.mode.handle_event(event)
+
+    profiler.lap('input')
+    if tick_rate is None:
+        instance.mode = instance.mode.update(pressed_keys, dt)
+    else:
+        instance.mode, accumulator, alpha = advance(instance.mode, pressed_keys, accumulator + dt, 1.0 / tick_rate)
+        instance.mode.draw(dt, alpha)
+
+    profiler.draw()
+    profiler.lap('overlay')
+    pg.display.flip()
+    profiler.lap('flip')
+    profiler.end_frame(instance.mode, dt)
+    return accumulator
 
 
 def loop():
+    replays.write_header()
+    accumulator = 0.0
     while 1:
-        dt = 0.001 * max(1, clock.tick())
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                save_game()
-                return
-            else:
-                instance.mode = instance.mode.handle_event(event)
+        dt = 0.001 * max(1, clock.tick(frame_rate_limit))
+        profiler.start_frame()
+        events = pg.event.get()
+        if any(x.type == pg.QUIT for x in events):
+            save_game()
+            solar_system_prefetcher.shutdown()
+            profiler.close_csv()
+            replays.stop_recording()
+            return
 
         pressed_keys = pg.key.get_pressed()
-        instance.mode = instance.mode.update(pressed_keys, dt)
+        accumulator = run_frame(dt, events, pressed_keys, accumulator)
+        replays.record_frame(dt, events, pressed_keys)
+        startup.first_frame()
 
-        pg.display.flip()
 
-
-def load_game(name):
+def load_game(name, lines=None):
     instance.name = name
 
     player = Player()
@@ -92,32 +141,33 @@ def load_game(name):
         return t
 
     try:
-        with open(f'../saves/{name}.txt') as file:
-            lines = [line.rstrip() for line in file.readlines()]
+        if lines is None:
+            with open(f'../saves/{name}.txt') as file:
+                lines = [line.rstrip() for line in file.readlines()]
 
-            player.ship_name = lines[0]
+        player.ship_name = lines[0]
 
-            player.engine.set_thrusters(read_thrusters(lines[1]))
-            player.engine.set_damp_factors(*(float(x) for x in lines[2].split(';;')))
+        player.engine.set_thrusters(read_thrusters(lines[1]))
+        player.engine.set_damp_factors(*(float(x) for x in lines[2].split(';;')))
 
-            pos = np.array([float(x) for x in lines[3].split(';;')])
-            vel = np.array([float(x) for x in lines[4].split(';;')])
-            angle = float(lines[5])
-            ang_vel = float(lines[6])
-            player.set_pos_vel(pos, vel, angle, ang_vel)
+        pos = np.array([float(x) for x in lines[3].split(';;')])
+        vel = np.array([float(x) for x in lines[4].split(';;')])
+        angle = float(lines[5])
+        ang_vel = float(lines[6])
+        player.set_pos_vel(pos, vel, angle, ang_vel)
 
-            instance.time = int(lines[7])
+        instance.time = float(lines[7])
 
-            mode_data = lines[8].split(';;')
-            if mode_data[0] == 'solar_system':
-                instance.mode = SolarSystemMode(mode_data[1], '')
-            elif mode_data[0] == 'planetary_system':
-                planet_pos = np.array([float(x) for x in mode_data[3].split('&&')])
-                instance.mode = PlanetarySystemMode(mode_data[1], int(mode_data[2]), planet_pos, '')
-            elif mode_data[0] == 'hyperspace':
-                instance.mode = HyperSpaceMode('')
+        mode_data = lines[8].split(';;')
+        if mode_data[0] == 'solar_system':
+            instance.mode = SolarSystemMode(mode_data[1], '')
+        elif mode_data[0] == 'planetary_system':
+            planet_pos = np.array([float(x) for x in mode_data[3].split('&&')])
+            instance.mode = PlanetarySystemMode(mode_data[1], int(mode_data[2]), planet_pos, '')
+        elif mode_data[0] == 'hyperspace':
+            instance.mode = HyperSpaceMode('')
 
-            player.visited_systems = {x for x in lines[9].split(';;')}
+        player.visited_systems = {x for x in lines[9].split(';;')}
 
     except EnvironmentError:
         player.ship_name = 'Cruiser'
@@ -131,54 +181,62 @@ def load_game(name):
 
         player.set_pos_vel(np.array([0.0, 0.0]), np.zeros(2), 0.0, 0.0)
 
-        instance.time = 0
+        instance.time = 0.0
 
         instance.mode = SolarSystemMode('Sol', '')
 
         player.visited_systems = {'SOL'}
 
 
-def save_game():
-    if not os.path.exists('../saves'):
-        os.makedirs('../saves')
-
+def get_save_lines():
     def thrusters_str(t):
         return ';;'.join(f'{v}..{k.name}' for (k, v) in helpers.quantity_dict(t).items())
 
     def known_systems_str(s):
         return ';;'.join(s)
 
-    with open(f'../saves/{instance.name}.txt', 'w') as file:
-        player = instance.player
-        file.write(f'{player.ship_name}\n')
-
-        file.write(f'{thrusters_str(player.engine.thrusters)}\n')
-        file.write(f'{player.engine.damp_factor};;{player.engine.ang_damp_factor}\n')
-
-        file.write(f'{player.pos[0]};;{player.pos[1]}\n')
-        file.write(f'{player.vel[0]};;{player.vel[1]}\n')
-        file.write(f'{player.angle}\n')
-        file.write(f'{player.ang_vel}\n')
+    player = instance.player
+    lines = [
+        player.ship_name,
+        thrusters_str(player.engine.thrusters),
+        f'{player.engine.damp_factor};;{player.engine.ang_damp_factor}',
+        f'{player.pos[0]};;{player.pos[1]}',
+        f'{player.vel[0]};;{player.vel[1]}',
+        f'{player.angle}',
+        f'{player.ang_vel}',
+        f'{instance.time}',
+    ]
+
+    mode = instance.mode
+    if type(mode) is SolarSystemMode:
+        lines.append(f'solar_system;;{mode.system.name}')
+    elif type(mode) is PlanetarySystemMode:
+        planet_pos = f'{mode.system_planet_pos[0]}&&{mode.system_planet_pos[1]}'
+        lines.append(f'planetary_system;;{mode.solar_system.name};;{mode.planet.number};;{planet_pos}')
+    elif type(mode) is HyperSpaceMode:
+        lines.append('hyperspace')
+
+    lines.append(known_systems_str(player.visited_systems))
+    return lines
 
-        file.write(f'{instance.time}\n')
 
-        mode = instance.mode
-        if type(mode) is SolarSystemMode:
-            file.write(f'solar_system;;{mode.system.name}\n')
-        elif type(mode) is PlanetarySystemMode:
-            planet_pos = f'{mode.system_planet_pos[0]}&&{mode.system_planet_pos[1]}'
-            file.write(f'planetary_system;;{mode.solar_system.name};;{mode.planet.number};;{planet_pos}\n')
-        elif type(mode) is HyperSpaceMode:
-            file.write(f'hyperspace\n')
+def save_game():
+    if not os.path.exists('../saves'):
+        os.makedirs('../saves')
 
-        file.write(f'{known_systems_str(player.visited_systems)}\n')
+    with open(f'../saves/{instance.name}.txt', 'w') as file:
+        file.writelines(f'{x}\n' for x in get_save_lines())
 
 
-def init():
-    global clock, screen, pause_sprite, search_sprite, search_font
+def init(display_size=(0, 0), save_name='game', save_lines=None):
+    global clock, screen, pause_sprite, search_sprite, search_font, suggestion_font
     clock = pg.time.Clock()
-    screen = Screen()
+    screen = Screen(display_size)
+    startup.lap('display init')
     pause_sprite = HUDSprite('../assets/images/pause.png', 1.0, screen.display_rect.center)
     search_sprite = HUDSprite('../assets/images/search.png', 1.0, screen.display_rect.center)
     search_font = pg.font.SysFont('Consolas', 52)
-    load_game('game')
+    suggestion_font = pg.font.SysFont('Consolas', 28)
+    startup.lap('hud')
+    load_game(save_name, save_lines)
+    startup.lap('first map build')
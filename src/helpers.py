@@ -1,12 +1,12 @@
 import hashlib
 import math
-import numba
 import numpy as np
 import os
 import pickle
 import pygame as pg
 
 import constants
+import jit
 import game
 
 
@@ -50,21 +50,29 @@ def rotate(image, rect, angle, center=None):
     return image, rect
 
 
-@numba.njit
+@jit.njit('float64, float64, float64', 'float64[::1], float64[::1], float64')
 def extended_mod(x, y, extension):
     return (x + extension) % (y + 2 * extension) - extension
 
 
-@numba.njit
+def extended_mod_array(x, y, extension):
+    return (x + extension) % (y + 2.0 * extension) - extension
+
+
+@jit.njit('float64, float64, float64')
 def extend_bounded(x, y, extension):
     return not x < -extension and not x > y + extension
 
 
-@numba.njit
+@jit.njit('float64[::1]', 'UniTuple(float64, 2)')
 def coords_to_pos(coords):
     return 500.0 * np.array([coords[0], -coords[1]])
 
 
+def coords_to_pos_array(coords):
+    return 500.0 * np.column_stack((coords[:, 0], -coords[:, 1]))
+
+
 def solar_system_width_f(system):
     return _solar_system_f_internal(system, game.screen.display_width)
 
@@ -82,7 +90,7 @@ def solar_system_star_f(system):
     return _solar_system_star_f_internal(system.radius)
 
 
-@numba.njit
+@jit.njit('float64')
 def _solar_system_star_f_internal(star_radius):
     return 2.0 * star_radius ** constants.inv_3
 
@@ -99,7 +107,7 @@ def solar_system_minimap_f(system):
     return 1.0 / _solar_system_f_internal(system, 1.0)
 
 
-@numba.njit
+@jit.njit('float64, float64')
 def _solar_system_orbit_f_internal(star_radius, planet_orbit):
     return 4.0 * star_radius ** 0.125 * planet_orbit ** constants.inv_3
 
@@ -108,7 +116,7 @@ def solar_system_planet_radius_f(planet):
     return _solar_system_planet_radius_f_internal(planet.radius)
 
 
-@numba.njit
+@jit.njit('float64')
 def _solar_system_planet_radius_f_internal(planet_radius):
     return (7.16 + planet_radius) / 43.92
 
@@ -130,7 +138,7 @@ def planetary_system_planet_f(planet):
     return _planetary_system_planet_f_internal(planet.radius)
 
 
-@numba.njit
+@jit.njit('float64')
 def _planetary_system_planet_f_internal(planet_radius):
     return (7.16 + planet_radius) / 32.94
 
@@ -139,7 +147,7 @@ def planetary_system_orbit_f(planet, moon):
     return _planetary_system_orbit_f_internal(planet.radius, moon.orbit)
 
 
-@numba.njit
+@jit.njit('float64, float64')
 def _planetary_system_orbit_f_internal(planet_radius, moon_orbit):
     return 0.275 * _planetary_system_planet_f_internal(planet_radius) * math.sqrt(moon_orbit)
 
@@ -148,12 +156,12 @@ def planetary_system_moon_radius_f(planet, moon):
     return _planetary_system_moon_radius_f_internal(planet.radius, moon.radius)
 
 
-@numba.njit
+@jit.njit('float64, float64')
 def _planetary_system_moon_radius_f_internal(planet_radius, moon_radius):
     return (7.16 + planet_radius) * (0.56 + moon_radius / planet_radius) / 72.0
 
 
-@numba.njit
+@jit.njit('float64')
 def temperature_color(temperature):
     celsius = temperature - 273.15
     if celsius < -150.0:
@@ -176,7 +184,7 @@ def temperature_color(temperature):
         return 0xff, 0x5f, 0x1f
 
 
-@numba.njit
+@jit.njit('float64, float64, float64')
 def clamped_lerp(a, b, x):
     if x <= 0.0:
         return a
@@ -186,6 +194,18 @@ def clamped_lerp(a, b, x):
         return (1.0 - x) * a + x * b
 
 
+def ellipse_contains_rect(ellipse_rect, rect):
+    cx, cy = ellipse_rect.centerx, ellipse_rect.centery
+    a, b = 0.5 * ellipse_rect.w, 0.5 * ellipse_rect.h
+    if a <= 0.0 or b <= 0.0:
+        return False
+    for x, y in (rect.topleft, rect.topright, rect.bottomleft, rect.bottomright):
+        dx, dy = (x - cx) / a, (y - cy) / b
+        if dx * dx + dy * dy >= 1.0:
+            return False
+    return True
+
+
 def each(seq, start):
     for i in range(start - len(seq), start):
         yield seq[i]
@@ -195,6 +215,10 @@ def positive_fmod(x, y):
     return np.fmod(np.fmod(x, y) + y, y)
 
 
+def angle_diff(a, b):
+    return positive_fmod(a - b + math.pi, constants.two_pi) - math.pi
+
+
 def normalize(vector):
     norm = np.linalg.norm(vector)
     return vector if norm <= 0.0 else vector / norm
@@ -0,0 +1,149 @@
+import pygame as pg
+
+import constants
+import game
+
+from caches import LRUCache
+from weakref import WeakKeyDictionary, finalize
+
+
+def get_scale(image, scale):
+    if isinstance(scale, (int, float)):
+        return scale
+    image_dim = image.get_width() if game.screen.display_min_dim_index == 0 else image.get_height()
+    return scale[0] * game.screen.display_min_dim / image_dim
+
+
+def scale_image(image, scale):
+    if scale == 1.0:
+        return image
+    return pg.transform.smoothscale(image, (scale * image.get_width(), scale * image.get_height()))
+
+
+def get_image_bytes(image):
+    return image.get_pitch() * image.get_height()
+
+
+class ImageCache:
+    # The budget is soft: images held by live sprites are never evicted, so the cache can run over it until they are released
+    def __init__(self, budget):
+        self.entries = LRUCache(budget, get_image_bytes, self.can_evict)
+        self.users = {}
+        self.lock = self.entries.lock
+
+    def can_evict(self, key):
+        return key not in self.users
+
+    def add_entry(self, key, image):
+        with self.lock:
+            existing = self.entries.get(key)
+            if existing is not None:
+                return existing
+            return self.entries.add(key, image)
+
+    def acquire(self, key, owner):
+        with self.lock:
+            self.users[key] = self.users.get(key, 0) + 1
+        finalize(owner, self.release, key)
+
+    def release(self, key):
+        with self.lock:
+            count = self.users[key] - 1
+            if count:
+                self.users[key] = count
+            else:
+                del self.users[key]
+
+    def has_source(self, path):
+        return (path, 1.0) in self.entries
+
+    def add_source(self, path, image):
+        # Images decoded by the prefetch worker are only converted for the display here, on the main thread
+        with self.lock:
+            if not self.has_source(path):
+                self.entries.add((path, 1.0), image.convert_alpha())
+
+    def get_source(self, path):
+        key = (path, 1.0)
+        image = self.entries.get(key)
+        if image is None:
+            image = self.add_entry(key, pg.image.load(path).convert_alpha())
+        return image
+
+    def get(self, path, scale, owner=None):
+        # An owner, usually a sprite, keeps the image from being evicted for as long as it lives
+        with self.lock:
+            source = self.get_source(path)
+            scale = get_scale(source, scale)
+            key = (path, scale)
+            image = source
+            if scale != 1.0:
+                image = self.entries.get(key)
+                if image is None:
+                    image = self.add_entry(key, scale_image(source, scale))
+            if owner is not None:
+                self.acquire(key, owner)
+            return image, scale
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.entries.get_stats(), 'in_use': len(self.users)}
+
+
+cache = ImageCache(64 * 1024 * 1024)
+
+
+class RotationCache:
+    def __init__(self, facings):
+        self.facings = facings
+        self.frames = WeakKeyDictionary()
+
+    def set_facings(self, facings):
+        self.facings = facings
+        self.frames.clear()
+
+    def get_facing(self, angle):
+        return round(angle * self.facings / constants.two_pi) % self.facings
+
+    def get_frame(self, image, facing):
+        if facing == 0:
+            return image
+
+        frames = self.frames.get(image)
+        if frames is None:
+            frames = [None] * self.facings
+            self.frames[image] = frames
+
+        frame = frames[facing]
+        if frame is None:
+            frame = pg.transform.rotate(image, -360.0 * facing / self.facings)
+            frames[facing] = frame
+        return frame
+
+
+rotations = RotationCache(256)
+
+
+def rotate(image, rect, angle, center=None):
+    if angle != 0.0:
+        image = rotations.get_frame(image, rotations.get_facing(angle))
+    rect = image.get_rect(center=rect.topleft if center is None else center)
+    return image, rect
+
+
+class MaskCache:
+    def __init__(self):
+        self.masks = WeakKeyDictionary()
+
+    def get(self, image):
+        mask = self.masks.get(image)
+        if mask is None:
+            mask = pg.mask.from_surface(image)
+            self.masks[image] = mask
+        return mask
+
+
+masks = MaskCache()
@@ -0,0 +1,79 @@
+import sys
+import threading
+import time as pt
+
+
+numba = None
+kernels = []
+dispatchers = []
+import_time = 0.0
+compile_time = 0.0
+warm_up_thread = None
+
+
+def njit(*signatures):
+    # Kernels run as plain Python until warm_up replaces them in their modules with the compiled versions.
+    # Each signature lists the argument types of one specialisation, compiled or loaded from the on-disk cache
+    def decorate(function):
+        kernels.append((function, signatures))
+        return function
+    return decorate
+
+
+def is_available():
+    return numba is not None
+
+
+def warm_up():
+    global numba, import_time, compile_time
+    if numba is None:
+        start = pt.perf_counter()
+        try:
+            import numba
+        except ImportError:
+            return compile_time
+        finally:
+            import_time = pt.perf_counter() - start
+
+    start = pt.perf_counter()
+    # Kernels are compiled in declaration order, so any kernel another one calls has already been replaced
+    for function, signatures in kernels[len(dispatchers):]:
+        kernel = numba.njit(cache=True)(function)
+        for signature in signatures:
+            kernel.compile(f'({signature},)')
+        setattr(sys.modules[function.__module__], function.__name__, kernel)
+        dispatchers.append(kernel)
+    compile_time += pt.perf_counter() - start
+    return compile_time
+
+
+def start_warm_up(done=None):
+    global warm_up_thread
+
+    def run():
+        warm_up()
+        if done is not None:
+            done()
+
+    warm_up_thread = threading.Thread(target=run, name='jit-warm-up', daemon=True)
+    warm_up_thread.start()
+
+
+def wait():
+    if warm_up_thread is not None:
+        warm_up_thread.join()
+
+
+def get_stats():
+    loaded = sum(sum(x.stats.cache_hits.values()) for x in dispatchers)
+    compiled = sum(sum(x.stats.cache_misses.values()) for x in dispatchers)
+    return {'enabled': is_available(), 'kernels': len(dispatchers), 'loaded': loaded, 'compiled': compiled,
+            'import': import_time, 'time': compile_time}
+
+
+def get_report():
+    if not is_available():
+        return 'numba is not available, running the kernels as plain Python'
+    stats = get_stats()
+    return (f'Warmed up {stats["kernels"]} kernels in {stats["time"]:.2f} s after importing numba in {stats["import"]:.2f} s '
+            f'({stats["loaded"]} loaded from cache, {stats["compiled"]} compiled)')
@@ -1,11 +1,54 @@
-import data
-import game
-import pygame as pg
+import argparse
+
+import startup
+
+
+def report_warm_up(begin):
+    startup.add('numba warm-up', begin)
+    print(jit.get_report())
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', action='store_true', help='show the frame profiler overlay (toggle with F3)')
+    parser.add_argument('--profile-csv', metavar='PATH', help='write per-frame phase timings to a CSV file')
+    parser.add_argument('--record', metavar='PATH', help='record input and frame times for replays.py')
+    parser.add_argument('--timeline', action='store_true', help='print how long each startup stage and module import took')
+    args = parser.parse_args()
+
+    # The game modules are imported once the arguments are known, so the timeline can include them
+    startup.set_enabled(args.timeline)
+    import pygame as pg
+
+    import data
+    import game
+    import jit
+    import profiler
+    import replays
+    startup.end_imports()
+
     pg.init()
+    startup.lap('pygame init')
     data.load()
+    startup.lap('data load')
+    if args.record:
+        replays.start_recording(args.record)
     game.init()
+    if args.record:
+        # Playback warms the kernels up before the first frame, so recordings have to start from compiled kernels too
+        jit.warm_up()
+        startup.lap('numba warm-up')
+        print(jit.get_report())
+    else:
+        # Until numba is ready the kernels run as plain Python, which keeps compilation off the first frames
+        warm_up_start = startup.get_time()
+        jit.start_warm_up(lambda: report_warm_up(warm_up_start))
+    if args.profile_csv:
+        profiler.open_csv(args.profile_csv)
+    if args.profile:
+        profiler.toggle_overlay()
     game.loop()
+    profiler.close_csv()
     pg.quit()
+    # Lets a warm-up still running finish writing the numba cache for the next start
+    jit.wait()
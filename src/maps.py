@@ -8,8 +8,10 @@ import constants
 import data
 import game
 import helpers
+import images
 import keys
 
+from collections import OrderedDict
 from pygame import Rect, Surface
 from sprites import Sprite, HUDSprite
 
@@ -22,9 +24,20 @@ class Element:
     def draw(self, camera, minimap, paused):
         self.sprite.draw(camera)
 
-    def minimap_draw(self, camera, paused):
+    def minimap_draw(self, surface):
         pass
 
+    def orbit_collides(self, rect):
+        return False
+
+    def draw_orbit(self, surface, offset):
+        pass
+
+    def get_bytes(self):
+        # The unrotated image is shared through images.cache, so only a rotated copy belongs to the element
+        sprite = self.sprite
+        return 0 if sprite.image is sprite.base_image else images.get_image_bytes(sprite.image)
+
 
 class SolarSystemElement(Element):
     def __init__(self, name, image, scale, pos, angle, system):
@@ -33,6 +46,15 @@ class SolarSystemElement(Element):
 
 
 class NaturalOrbitingElement(Element):
+    def orbit_collides(self, rect):
+        ellipse_rect = getattr(self, 'ellipse_rect', None)
+        if ellipse_rect is None or not rect.colliderect(ellipse_rect):
+            return False
+        return not helpers.ellipse_contains_rect(ellipse_rect.inflate(-2, -2), rect)
+
+    def draw_orbit(self, surface, offset):
+        pg.draw.ellipse(surface, self.ellipse_color, self.ellipse_rect.move(*offset), 1)
+
     def highlight(self, offset, orbit_number, pulse_frequency, pointer_rect, highlight_rect, ellipse_color):
         pressed_keys = pg.key.get_pressed()
         if keys.contains_number(pressed_keys, orbit_number):
@@ -61,42 +83,58 @@ class SolarSystemStarElement(SolarSystemElement):
         super().__init__(name, image, scale, pos, angle, system)
         self.minimap_sprite = HUDSprite(image, (helpers.solar_system_minimap_f(system) * scale[0],), game.screen.minimap_center)
 
-    def minimap_draw(self, camera, paused):
-        self.minimap_sprite.draw(camera)
+    def minimap_draw(self, surface):
+        surface.blit(self.minimap_sprite.image, self.minimap_sprite.rect)
 
 
 class SolarSystemPlanetElement(SolarSystemElement, NaturalOrbitingElement):
-    def __init__(self, name, image, sprite_scale, orbit_scale, system, planet, time, minimap_scale):
-        orbit_size = orbit_scale * game.screen.display_size
-        self.orbit_angle = planet.initial_angle + 0.0172017 * time * math.sqrt(system.mass / (planet.orbit * planet.orbit * planet.orbit))
+    def __init__(self, name, image, sprite_scale, orbit_scale, system, planet, orbit_angle, minimap_scale):
+        self.orbit_size = orbit_scale * game.screen.display_size
+        self.orbit_angle = orbit_angle
         cos_sin_orbit_angle = np.array([math.cos(self.orbit_angle), math.sin(self.orbit_angle)])
-        super().__init__(name, image, sprite_scale, orbit_size * cos_sin_orbit_angle, planet.tilt, system)
+        super().__init__(name, image, sprite_scale, self.orbit_size * cos_sin_orbit_angle, planet.tilt, system)
 
-        self.ellipse_rect = Rect(-orbit_size, 2.0 * orbit_size)
+        self.ellipse_rect = Rect(-self.orbit_size, 2.0 * self.orbit_size)
         rect = self.sprite.rect
         self.pointer_rect = Rect(rect.x, rect.y, rect.w, rect.h)
         self.highlight_rect = Rect(rect.x - 8, rect.y - 8, rect.w + 16, rect.h + 16)
 
-        minimap_orbit_size = game.screen.minimap_size_mult * minimap_scale * orbit_size
-        minimap_orbit_pos = game.screen.minimap_center + minimap_orbit_size * cos_sin_orbit_angle
+        self.minimap_orbit_size = game.screen.minimap_size_mult * minimap_scale * self.orbit_size
+        minimap_orbit_pos = game.screen.minimap_center + self.minimap_orbit_size * cos_sin_orbit_angle
         self.minimap_sprite = HUDSprite(image, (minimap_scale * sprite_scale[0],), minimap_orbit_pos)
 
-        self.minimap_ellipse_rect = Rect(game.screen.minimap_center - minimap_orbit_size, 2.0 * minimap_orbit_size)
+        self.minimap_ellipse_rect = Rect(game.screen.minimap_center - self.minimap_orbit_size, 2.0 * self.minimap_orbit_size)
 
         self.planet = planet
         self.ellipse_color = helpers.temperature_color(planet.temperature)
 
+    def set_orbit_angle(self, orbit_angle):
+        self.orbit_angle = orbit_angle
+        cos, sin = math.cos(orbit_angle), math.sin(orbit_angle)
+        orbit_width, orbit_height = self.orbit_size.tolist()
+        self.sprite.pos = np.array([orbit_width * cos, orbit_height * sin])
+        self.sprite.set_rect_pos()
+        rect = self.sprite.rect
+        self.pointer_rect.topleft = rect.topleft
+        self.highlight_rect.topleft = rect.x - 8, rect.y - 8
+
+        minimap_rect = self.minimap_sprite.rect
+        minimap_topleft = minimap_rect.topleft
+        (center_x, center_y), (minimap_width, minimap_height) = game.screen.minimap_center.tolist(), self.minimap_orbit_size.tolist()
+        self.minimap_sprite.pos = np.array([center_x + minimap_width * cos, center_y + minimap_height * sin])
+        self.minimap_sprite.set_rect_pos()
+        return minimap_rect.topleft != minimap_topleft
+
     def draw(self, camera, minimap, paused):
         offset = -camera[0], -camera[1]
-        pg.draw.ellipse(game.screen.display, self.ellipse_color, self.ellipse_rect.move(*offset), 1)
         super().draw(camera, minimap, paused)
         if not paused:
             freq = 0.25 / math.sqrt(helpers.solar_system_planet_radius_f(self.planet))
             self.highlight(offset, self.planet.number, freq, self.pointer_rect, self.highlight_rect, self.ellipse_color)
 
-    def minimap_draw(self, camera, paused):
-        pg.draw.ellipse(game.screen.display, self.ellipse_color, self.minimap_ellipse_rect, 1)
-        self.minimap_sprite.draw(camera)
+    def minimap_draw(self, surface):
+        pg.draw.ellipse(surface, self.ellipse_color, self.minimap_ellipse_rect, 1)
+        surface.blit(self.minimap_sprite.image, self.minimap_sprite.rect)
 
 
 class PlanetarySystemElement(Element):
@@ -106,19 +144,30 @@ class PlanetarySystemElement(Element):
 
 
 class PlanetarySystemPlanetElement(PlanetarySystemElement, NaturalOrbitingElement):
-    def __init__(self, name, image, scale, pos, angle, system, planet, time):
+    def __init__(self, name, image, scale, pos, angle, system, planet, line_angle):
         super().__init__(name, image, scale, pos, angle, planet)
         self.orbit_angle = None
         # rect = self.sprite.rect
         # self.pointer_rect = Rect(rect.x, rect.y, rect.w, rect.h)
         # self.highlight_rect = Rect(rect.x - 8, rect.y - 8, rect.w + 16, rect.h + 16)
         self.ellipse_color = helpers.temperature_color(planet.temperature)
-        line_angle = planet.initial_angle + 0.0172017 * time * math.sqrt(system.mass / (planet.orbit * planet.orbit * planet.orbit))
+        self.line_pos = None
+        self.set_line_angle(line_angle)
+
+    def set_line_angle(self, line_angle):
         display_mult = game.screen.display_max_dim / game.screen.display_min_dim
-        self.line_pos = display_mult * np.array([game.screen.display_width * math.sin(line_angle), -game.screen.display_height * math.cos(line_angle)])
+        line_pos = display_mult * np.array([game.screen.display_width * math.sin(line_angle), -game.screen.display_height * math.cos(line_angle)])
+        changed = self.line_pos is None or (line_pos.astype(int) != self.line_pos.astype(int)).any()
+        self.line_pos = line_pos
+        return changed
+
+    def orbit_collides(self, rect):
+        return bool(rect.clipline(self.line_pos, -self.line_pos))
+
+    def draw_orbit(self, surface, offset):
+        pg.draw.line(surface, self.ellipse_color, self.line_pos + offset, -self.line_pos + offset, 1)
 
     def draw(self, camera, minimap, paused):
-        pg.draw.line(game.screen.display, self.ellipse_color, self.line_pos - camera, -self.line_pos - camera, 1)
         super().draw(camera, minimap, paused)
         # if not paused:
         # freq = 0.25 / math.sqrt(helpers.planetary_system_moon_radius_f(self.planet, self.planet))
@@ -126,13 +175,13 @@ class PlanetarySystemPlanetElement(PlanetarySystemElement, NaturalOrbitingElemen
 
 
 class PlanetarySystemMoonElement(PlanetarySystemElement, NaturalOrbitingElement):
-    def __init__(self, name, image, sprite_scale, orbit_scale, planet, moon, time):
-        orbit_size = game.screen.display_size * orbit_scale
-        self.orbit_angle = moon.initial_angle + 971.903 * time * math.sqrt(planet.mass / (moon.orbit * moon.orbit * moon.orbit))
+    def __init__(self, name, image, sprite_scale, orbit_scale, planet, moon, orbit_angle):
+        self.orbit_size = game.screen.display_size * orbit_scale
+        self.orbit_angle = orbit_angle
         cos_sin_orbit_angle = np.array([math.cos(self.orbit_angle), math.sin(self.orbit_angle)])
-        super().__init__(name, image, sprite_scale, orbit_size * cos_sin_orbit_angle, planet.tilt, planet)
+        super().__init__(name, image, sprite_scale, self.orbit_size * cos_sin_orbit_angle, planet.tilt, planet)
 
-        self.ellipse_rect = Rect(-orbit_size, 2.0 * orbit_size)
+        self.ellipse_rect = Rect(-self.orbit_size, 2.0 * self.orbit_size)
         rect = self.sprite.rect
         self.pointer_rect = Rect(rect.x, rect.y, rect.w, rect.h)
         self.highlight_rect = Rect(rect.x - 8, rect.y - 8, rect.w + 16, rect.h + 16)
@@ -140,9 +189,17 @@ class PlanetarySystemMoonElement(PlanetarySystemElement, NaturalOrbitingElement)
         self.moon = moon
         self.ellipse_color = helpers.temperature_color(moon.temperature)
 
+    def set_orbit_angle(self, orbit_angle):
+        self.orbit_angle = orbit_angle
+        orbit_width, orbit_height = self.orbit_size.tolist()
+        self.sprite.pos = np.array([orbit_width * math.cos(orbit_angle), orbit_height * math.sin(orbit_angle)])
+        self.sprite.set_rect_pos()
+        rect = self.sprite.rect
+        self.pointer_rect.topleft = rect.topleft
+        self.highlight_rect.topleft = rect.x - 8, rect.y - 8
+
     def draw(self, camera, minimap, paused):
         offset = -camera[0], -camera[1]
-        pg.draw.ellipse(game.screen.display, self.ellipse_color, self.ellipse_rect.move(*offset), 1)
         super().draw(camera, minimap, paused)
         if not paused:
             freq = 0.25 / math.sqrt(helpers.planetary_system_moon_radius_f(self.planet, self.moon))
@@ -183,15 +240,135 @@ class ElementSprite(Sprite):
 class Map:
     def __init__(self):
         self.elems = []
+        self.time = None
+        self.minimap_version = 0
+
+    def set_time(self, time):
+        self.time = time
+
+    def get_bytes(self):
+        return sum(x.get_bytes() for x in self.elems)
+
+
+class OrbitLayer:
+    def __init__(self, elems, tile_size, origin):
+        self.elems = elems
+        self.tile_width, self.tile_height = tile_size
+        self.origin = origin
+        self.tiles = OrderedDict()
+        self.key_color = (0, 0, 0)
+        display_tiles = (math.ceil(game.screen.display_width / self.tile_width) + 1) * (math.ceil(game.screen.display_height / self.tile_height) + 1)
+        self.max_tiles = 4 * display_tiles
+
+    def get_tile(self, key):
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        width, height = self.tile_width, self.tile_height
+        tile_x, tile_y = self.origin[0] + key[0] * width, self.origin[1] + key[1] * height
+        tile_rect = Rect(tile_x, tile_y, width, height)
+        tile_elems = [x for x in self.elems if x.orbit_collides(tile_rect)]
+        tile = None
+        if tile_elems:
+            tile = Surface((width, height)).convert()
+            tile.fill(self.key_color)
+            tile.set_colorkey(self.key_color, pg.RLEACCEL)
+            offset = -tile_x, -tile_y
+            for elem in tile_elems:
+                elem.draw_orbit(tile, offset)
+
+        self.tiles[key] = tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def invalidate(self):
+        self.tiles.clear()
+
+    def get_bytes(self):
+        return sum(images.get_image_bytes(x) for x in self.tiles.values() if x is not None)
+
+    def get_visible_keys(self, camera):
+        width, height = self.tile_width, self.tile_height
+        left, top = camera[0] - self.origin[0], camera[1] - self.origin[1]
+        x_min, x_max = math.floor(left / width), math.ceil((left + game.screen.display_width) / width)
+        y_min, y_max = math.floor(top / height), math.ceil((top + game.screen.display_height) / height)
+        return [(x, y) for x in range(x_min, x_max) for y in range(y_min, y_max)]
+
+    def draw(self, camera):
+        width, height = self.tile_width, self.tile_height
+        left, top = camera[0] - self.origin[0], camera[1] - self.origin[1]
+        blit_sequence = []
+        for x, y in self.get_visible_keys(camera):
+            tile = self.get_tile((x, y))
+            if tile is not None:
+                blit_sequence.append((tile, (x * width - left, y * height - top)))
+        game.screen.draw_many(blit_sequence)
+
+
+class MinimapLayer:
+    def __init__(self, space_map, color, background_sprites):
+        self.space_map = space_map
+        self.color = color
+        self.background_sprites = background_sprites
+        self.surface = None
+        self.version = None
+        self.key_color = (255, 0, 255)
+
+    def invalidate(self):
+        self.surface = None
+        self.version = None
+
+    def build(self):
+        screen = game.screen
+        surface = Surface(screen.display_rect.size).convert()
+        surface.fill(self.key_color)
+
+        corner_color = np.multiply(0.5, np.add((127, 127, 127), self.color))
+        edge_color = np.multiply(1.2, corner_color), np.multiply(0.8, corner_color)
+        minimap_rect = screen.minimap_rect
+        border = screen.minimap_border
+        pg.draw.rect(surface, corner_color, minimap_rect.move(-border, border))
+        pg.draw.rect(surface, corner_color, minimap_rect.move(border, -border))
+        pg.draw.rect(surface, edge_color[0], minimap_rect.move(-border, -border))
+        pg.draw.rect(surface, edge_color[1], minimap_rect.move(border, border))
+        pg.draw.rect(surface, self.color, minimap_rect)
+
+        surface.set_clip(minimap_rect.inflate(2 * border, 2 * border))
+        surface.blits([(x.image, x.rect) for x in self.background_sprites], doreturn=False)
+        for elem in self.space_map.elems:
+            elem.minimap_draw(surface)
+        surface.set_clip(None)
+
+        surface.set_colorkey(self.key_color, pg.RLEACCEL)
+        self.surface = surface
+        self.version = self.space_map.minimap_version
+
+    def draw(self):
+        if self.surface is None or self.version != self.space_map.minimap_version:
+            self.build()
+        game.screen.draw(self.surface, (0, 0))
+
+    def get_bytes(self):
+        image_bytes = sum(images.get_image_bytes(x.image) for x in self.background_sprites)
+        return image_bytes + (0 if self.surface is None else images.get_image_bytes(self.surface))
 
 
 class TrueSpaceMap(Map):
     def __init__(self):
         super().__init__()
+        self.orbit_layer = None
+
+    def build_orbit_layer(self, tile_size, origin):
+        self.orbit_layer = OrbitLayer(self.elems, tile_size, origin)
+
+    def get_bytes(self):
+        return super().get_bytes() + self.orbit_layer.get_bytes()
 
 
 class SolarSystemMap(TrueSpaceMap):
-    def __init__(self, name, time):
+    def __init__(self, name, time, incremental=False):
         super().__init__()
         self.system = data.systems[name]
 
@@ -203,11 +380,70 @@ class SolarSystemMap(TrueSpaceMap):
         self.minimap_scale = helpers.solar_system_minimap_f(self.system) / self.scale
         self.elems.append(SolarSystemStarElement(name, star_image, (cbrt_star_f,), np.zeros(2), 0.0, self.system))
 
-        for planet in self.system.planets:
-            planet_image = get_planet_image(planet)
-            planet_radius_scale = self.scale * helpers.solar_system_planet_radius_f(planet)
-            planet_orbit_scale = self.scale * helpers.solar_system_orbit_f(self.system, planet)
-            self.elems.append(SolarSystemPlanetElement(planet.name, planet_image, (planet_radius_scale,), planet_orbit_scale, self.system, planet, time, self.minimap_scale))
+        self.ephemeris = data.get_ephemeris(self.system)
+        self.time = time
+        self.planet_elems = [None] * len(self.system.planets)
+        self.pending = list(range(len(self.system.planets)))
+
+        self.build_orbit_layer((512, 512), (0, 0))
+
+        if not incremental:
+            while self.build_next():
+                pass
+
+    def get_planet_orbit_scale(self, planet):
+        return self.scale * helpers.solar_system_orbit_f(self.system, planet)
+
+    def build_planet(self, index):
+        if self.planet_elems[index] is not None:
+            return
+        planet = self.system.planets[index]
+        planet_angle = self.ephemeris.get_angles(self.time)[self.ephemeris.get_planet_slice()][index]
+        planet_image = get_planet_image(planet)
+        planet_radius_scale = self.scale * helpers.solar_system_planet_radius_f(planet)
+        planet_orbit_scale = self.get_planet_orbit_scale(planet)
+        elem = SolarSystemPlanetElement(planet.name, planet_image, (planet_radius_scale,), planet_orbit_scale, self.system, planet, float(planet_angle), self.minimap_scale)
+        self.planet_elems[index] = elem
+        self.pending.remove(index)
+        if self.pending:
+            self.elems.append(elem)
+        else:
+            # Restore planet order once every element exists; the orbit layer holds this same list
+            self.elems[1:] = self.planet_elems
+            self.orbit_layer.invalidate()
+        self.minimap_version += 1
+
+    def build_next(self):
+        if not self.pending:
+            return False
+        self.build_planet(self.pending[0])
+        return True
+
+    def is_built(self):
+        return not self.pending
+
+    def prioritize(self, pos):
+        planet_angles = self.ephemeris.get_angles(self.time)[self.ephemeris.get_planet_slice()]
+        display_size = game.screen.display_size
+
+        def get_distance(index):
+            orbit = self.get_planet_orbit_scale(self.system.planets[index]) * display_size
+            angle = planet_angles[index]
+            return math.hypot(orbit[0] * math.cos(angle) - pos[0], orbit[1] * math.sin(angle) - pos[1])
+
+        self.pending.sort(key=get_distance)
+
+    def set_time(self, time):
+        if time == self.time:
+            return
+        self.time = time
+        minimap_changed = False
+        planet_angles = self.ephemeris.get_angles(time)[self.ephemeris.get_planet_slice()]
+        for elem, planet_angle in zip(self.planet_elems, planet_angles):
+            if elem is not None:
+                minimap_changed |= elem.set_orbit_angle(float(planet_angle))
+        if minimap_changed:
+            self.minimap_version += 1
 
 
 class PlanetarySystemMap(TrueSpaceMap):
@@ -224,13 +460,32 @@ class PlanetarySystemMap(TrueSpaceMap):
         self.half_width *= self.scale
         self.half_height *= self.scale
         planet_scale = self.scale * helpers.planetary_system_planet_f(planet)
-        self.elems.append(PlanetarySystemPlanetElement(planet.name, planet_image, (planet_scale,), np.zeros(2), planet.tilt, system, planet, time))
-
-        for moon in planet.moons:
+        self.ephemeris = data.get_ephemeris(system)
+        self.time = time
+        angles = self.ephemeris.get_angles(time)
+        line_angle = angles[planet.number - 1]
+        self.planet_elem = PlanetarySystemPlanetElement(planet.name, planet_image, (planet_scale,), np.zeros(2), planet.tilt, system, planet, float(line_angle))
+        self.elems.append(self.planet_elem)
+
+        for moon, moon_angle in zip(planet.moons, angles[self.ephemeris.get_moon_slice(planet.number)]):
             moon_image = get_planet_image(moon)
             moon_radius_scale = self.scale * helpers.planetary_system_moon_radius_f(planet, moon)
             moon_orbit_scale = self.scale * helpers.planetary_system_orbit_f(planet, moon)
-            self.elems.append(PlanetarySystemMoonElement(moon.name, moon_image, (moon_radius_scale,), moon_orbit_scale, planet, moon, time))
+            self.elems.append(PlanetarySystemMoonElement(moon.name, moon_image, (moon_radius_scale,), moon_orbit_scale, planet, moon, float(moon_angle)))
+        self.moon_elems = self.elems[1:]
+
+        origin = -0.5 * game.screen.display_size
+        self.build_orbit_layer(game.screen.display_rect.size, (origin[0], origin[1]))
+
+    def set_time(self, time):
+        if time == self.time:
+            return
+        self.time = time
+        angles = self.ephemeris.get_angles(time)
+        if self.planet_elem.set_line_angle(float(angles[self.planet.number - 1])):
+            self.orbit_layer.invalidate()
+        for elem, moon_angle in zip(self.moon_elems, angles[self.ephemeris.get_moon_slice(self.planet.number)]):
+            elem.set_orbit_angle(float(moon_angle))
 
 
 color_map = {
@@ -257,12 +512,46 @@ def get_planet_image(planet):
     return assets.get_planet(planet.type_name, planet.orbit)
 
 
+class ElementGrid:
+    def __init__(self, elems, cell_size):
+        self.elems = elems
+        self.cell_size = cell_size
+        self.cells = {}
+        for index, elem in enumerate(elems):
+            rect = elem.sprite.rect
+            for key in self.get_cell_keys(rect.left, rect.top, rect.right, rect.bottom):
+                self.cells.setdefault(key, []).append(index)
+
+    def get_cell_keys(self, left, top, right, bottom):
+        size = self.cell_size
+        x_min, x_max = math.floor(left / size), math.floor(right / size)
+        y_min, y_max = math.floor(top / size), math.floor(bottom / size)
+        return [(x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+    def query(self, left, top, right, bottom):
+        indices = set()
+        for key in self.get_cell_keys(left, top, right, bottom):
+            cell = self.cells.get(key)
+            if cell is not None:
+                indices.update(cell)
+        return [self.elems[i] for i in sorted(indices)]
+
+
 class HyperSpaceMap(Map):
     def __init__(self):
         super().__init__()
         for system in data.systems.values():
             image = get_hyperspace_star_image(system)
             self.elems.append(HyperSpaceSystemElement(system.name, image, 2.0, system.coords, 0.0))
+        self.grid = ElementGrid(self.elems, game.screen.display_max_dim)
+
+    def get_visible_elems(self, camera):
+        display_size = game.screen.display_size
+        return self.grid.query(camera[0], camera[1], camera[0] + display_size[0], camera[1] + display_size[1])
+
+    def get_nearby_elems(self, sprite):
+        x, y, radius = sprite.rect.centerx, sprite.rect.centery, sprite.radius
+        return self.grid.query(x - radius, y - radius, x + radius, y + radius)
 
 
 def get_hyperspace_star_image(star):
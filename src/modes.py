@@ -2,20 +2,29 @@ import math
 import numpy as np
 import pygame as pg
 import random
+import time as pt
 
 import backgrounds
 import constants
 import data
 import helpers
 import game
+import images
+import profiler
+import replays
+import search
 import spaces
 
 from abc import ABCMeta
 from dataclasses import dataclass
 
+from caches import LRUCache
 from engines import NPCEngine
 from fades import Fade
-from maps import HyperSpaceMap, SolarSystemMap, PlanetarySystemMap, HyperSpaceSystemElement, NaturalOrbitingElement
+from fleets import Fleet
+from prefetch import Prefetcher
+from maps import HyperSpaceMap, SolarSystemMap, PlanetarySystemMap, HyperSpaceSystemElement, NaturalOrbitingElement, MinimapLayer
+from maps import get_planet_image, get_truespace_star_image
 from ships import InterceptShip
 
 
@@ -83,6 +92,35 @@ def get_moon_letters(planet):
     return [helpers.to_letter(x + 1) for x in range(len(planet.moons))]
 
 
+def split_search_suffix(text):
+    parts = text.rsplit(' ', 1)
+    if len(parts) == 2:
+        planet_suffix = parts[1].split('-')[0]
+        if planet_suffix in helpers.roman_numeral_inv_map or planet_suffix.isnumeric():
+            return parts[0], parts[1]
+    return text, ''
+
+
+def get_planet_search_index(system):
+    return search.get_index(('planet_names', system.name), get_planet_search_names, system)
+
+
+def get_planet_search_suffix_index(system):
+    return search.get_index(('planet_suffixes', system.name), get_planet_search_suffixes, system)
+
+
+def get_moon_search_index(planet):
+    return search.get_index(('moon_names', planet.name), get_moon_search_names, planet)
+
+
+def get_moon_search_suffix_index(planet):
+    return search.get_index(('moon_suffixes', planet.name), get_moon_search_suffixes, planet)
+
+
+def get_moon_letter_index(planet):
+    return search.get_index(('moon_letters', planet.name), get_moon_letters, planet)
+
+
 class Mode:
     def __init__(self):
         pass
@@ -90,16 +128,23 @@ class Mode:
     def handle_event(self, event):
         raise NotImplementedError
 
-    def update(self, pressed_keys, dt):
+    def step(self, pressed_keys, dt):
         raise NotImplementedError
 
+    def draw(self, dt, alpha):
+        raise NotImplementedError
+
+    def update(self, pressed_keys, dt):
+        mode = self.step(pressed_keys, dt)
+        mode.draw(dt, 1.0)
+        return mode
+
 
 class SpaceMode(Mode, metaclass=ABCMeta):
     def __init__(self, scale, space, space_map, autopilot_text):
         super().__init__()
         game.screen.background_color = space.color
-        self.background_sprites = set()
-        self.minimap_background_sprites = set()
+        self.starfield = None
         self.npc_ships = set()
         self.npc_ships_remove = set()
 
@@ -117,6 +162,8 @@ class SpaceMode(Mode, metaclass=ABCMeta):
         self.searching = False
         self.search_text = ''
         self.search_text_color = (255, 255, 255)
+        self.search_suggestions = []
+        self.search_suggestion_count = 5
 
         if game.start:
             self.paused = True
@@ -126,24 +173,56 @@ class SpaceMode(Mode, metaclass=ABCMeta):
         self.player_ship = game.instance.player.get_ship(self.scale, self.space)
         self.can_collide = False
 
+    def advance_time(self, dt):
+        game.instance.time += game.time_scale * dt
+        self.space_map.set_time(game.instance.time)
+
     def set_autopilot_target(self):
         raise NotImplementedError
 
+    def get_search_pos(self):
+        return None
+
+    def get_search_suggestions(self):
+        text = self.search_text
+        if not text:
+            return []
+        count = self.search_suggestion_count
+        fuzzy_index = data.get_system_fuzzy_index()
+        pos = self.get_search_pos()
+        results = fuzzy_index.query(text, count, pos)
+        system_text, suffix = split_search_suffix(text)
+        if suffix:
+            visited_systems = game.instance.player.visited_systems
+            for system_name, score in fuzzy_index.query(system_text, count, pos):
+                if system_name in visited_systems:
+                    name = f'{system_name} {suffix}'
+                    system = data.systems[system_name.title()]
+                    planet_name = get_planet_search_index(system).contained_prefix(name)
+                    if planet_name == name:
+                        results.append((name, score))
+                    elif planet_name:
+                        planet_number = get_planet_number(system_name, planet_name)
+                        if name in get_moon_search_index(system.planets[planet_number - 1]):
+                            results.append((name, score))
+        results.sort(key=lambda x: -x[1])
+        return [name for name, _ in results[:count]]
+
     def get_search_autocomplete(self):
         text = self.search_text
-        auto = helpers.auto_complete(text, data.system_search_names)
+        system_index = data.get_system_search_index()
+        auto = system_index.auto_complete(text)
         if not auto:
-            system_name = helpers.contained_prefix(text, game.instance.player.visited_systems)
+            system_name = system_index.contained_prefix(text, game.instance.player.visited_systems)
             if system_name:
                 system = data.systems.get(system_name.title())
-                planet_names = get_planet_search_names(system)
-                auto = helpers.auto_complete(text, planet_names)
+                planet_index = get_planet_search_index(system)
+                auto = planet_index.auto_complete(text)
                 if not auto:
-                    planet_name = helpers.contained_prefix(text, planet_names)
+                    planet_name = planet_index.contained_prefix(text)
                     if planet_name:
                         planet_number = get_planet_number(system_name, planet_name)
-                        moon_names = get_moon_search_names(system.planets[planet_number - 1])
-                        auto = helpers.auto_complete(text, moon_names)
+                        auto = get_moon_search_index(system.planets[planet_number - 1]).auto_complete(text)
         return auto
 
     def handle_event(self, event):
@@ -162,6 +241,11 @@ class SpaceMode(Mode, metaclass=ABCMeta):
             elif self.searching:
                 if event.key == pg.K_RETURN:
                     auto_text = self.get_search_autocomplete()
+                    if not auto_text and self.search_suggestions:
+                        self.search_text = self.search_suggestions[0]
+                        self.search_text_color = (255, 255, 255)
+                        self.search_suggestions = []
+                        return self
                     self.autopilot_text = search_convert(auto_text)
                     if self.autopilot_text == search_convert(self.search_text):
                         self.set_autopilot_target()
@@ -186,12 +270,14 @@ class SpaceMode(Mode, metaclass=ABCMeta):
 
                     self.search_text = helpers.single_spaces(self.search_text, False, True)
                     auto_text = self.get_search_autocomplete()
+                    self.search_suggestions = []
                     if auto_text:
                         self.search_text_color = (255, 255, 255)
                         if auto_complete:
                             self.search_text = auto_text.upper()
                     else:
                         self.search_text_color = (255, 0, 0)
+                        self.search_suggestions = self.get_search_suggestions()
             elif not self.paused:
                 if event.key == pg.K_p:
                     self.autopilot_text = '#p'
@@ -211,6 +297,12 @@ class SpaceMode(Mode, metaclass=ABCMeta):
             display_rect = game.screen.display_rect
             text_rect = text_surf.get_rect(centerx=display_rect.centerx, centery=display_rect.centery + 4)
             game.screen.draw(text_surf, text_rect)
+            suggestion_y = text_rect.bottom + 16
+            for suggestion in self.search_suggestions:
+                suggestion_surf = game.suggestion_font.render(suggestion, True, (191, 191, 191))
+                suggestion_rect = suggestion_surf.get_rect(centerx=display_rect.centerx, top=suggestion_y)
+                game.screen.draw(suggestion_surf, suggestion_rect)
+                suggestion_y = suggestion_rect.bottom + 4
 
 
 class TrueSpaceMode(SpaceMode, metaclass=ABCMeta):
@@ -218,20 +310,151 @@ class TrueSpaceMode(SpaceMode, metaclass=ABCMeta):
         super().__init__(scale, spaces.truespace, space_map, autopilot_text)
 
 
+@dataclass
+class SolarSystemScene:
+    system_map: SolarSystemMap
+    starfield: 'backgrounds.Starfield'
+    minimap_layer: MinimapLayer
+
+    def get_bytes(self):
+        return self.system_map.get_bytes() + self.starfield.get_bytes() + self.minimap_layer.get_bytes()
+
+
+class SolarSystemSceneBuilder:
+    def __init__(self, name):
+        self.system_map = SolarSystemMap(name, game.instance.time, True)
+        self.rng = random.Random(helpers.deterministic_hash(self.system_map.system.name))
+        self.sqrt_scale = math.sqrt(self.system_map.scale)
+        self.star_count = int(200.0 / self.sqrt_scale)
+        self.background_sprites = []
+        self.minimap_background_sprites = set()
+        self.orbit_keys = []
+        self.scene = None
+
+    def set_camera(self, camera):
+        orbit_layer = self.system_map.orbit_layer
+        self.orbit_keys = [x for x in orbit_layer.get_visible_keys(camera) if x not in orbit_layer.tiles]
+
+    def build_next(self):
+        if self.system_map.build_next():
+            return True
+        if self.orbit_keys:
+            self.system_map.orbit_layer.get_tile(self.orbit_keys.pop())
+            return True
+        if len(self.background_sprites) < self.star_count:
+            rng = self.rng
+            bg_scale = 0.2 * self.sqrt_scale * (1.0 + rng.random())
+            bg_dist = max(1.0, 2.0 * (1.0 + rng.random()))
+            self.background_sprites.append(backgrounds.random_truespace_background_star(bg_scale, bg_dist / self.system_map.scale, rng))
+            self.minimap_background_sprites.add(backgrounds.random_truespace_minimap_background_star(0.5 * bg_scale, rng))
+            return True
+        if self.scene is None:
+            starfield = backgrounds.Starfield(self.background_sprites)
+            minimap_layer = MinimapLayer(self.system_map, spaces.truespace.color, self.minimap_background_sprites)
+            self.scene = SolarSystemScene(self.system_map, starfield, minimap_layer)
+        return False
+
+    def build(self, budget=None):
+        start = pt.perf_counter()
+        while self.build_next():
+            if budget is not None and pt.perf_counter() - start >= budget:
+                break
+        return self.scene
+
+
+def build_solar_system_scene(name):
+    return SolarSystemSceneBuilder(name).build()
+
+
+def prepare_solar_system_scene(name):
+    # Runs on the prefetch worker, so it only computes plain data and decodes images; converting, scaling and rotating
+    # surfaces is left to the scene builders on the main thread
+    system = data.systems[name]
+    data.get_ephemeris(system)
+    paths = {get_truespace_star_image(system), *(get_planet_image(x) for x in system.planets), *backgrounds.truespace_background_star_names}
+    return {x: pg.image.load(x) for x in paths if not images.cache.has_source(x)}
+
+
+solar_system_scenes = LRUCache(96 * 1024 * 1024, SolarSystemScene.get_bytes)
+planetary_system_maps = LRUCache(32 * 1024 * 1024, PlanetarySystemMap.get_bytes)
+solar_system_prefetcher = Prefetcher(prepare_solar_system_scene)
+solar_system_builders = {}
+
+
+def add_prefetched_sources(sources):
+    for path, image in (sources or {}).items():
+        images.cache.add_source(path, image)
+
+
+def get_solar_system_scene(name, incremental=False):
+    scene = solar_system_scenes.get(name)
+    if scene is None:
+        collect_prefetched_scenes()
+        builder = solar_system_builders.pop(name, None)
+        if builder is None:
+            # Waits for the worker if it is still preparing this system
+            add_prefetched_sources(solar_system_prefetcher.take(name))
+            builder = SolarSystemSceneBuilder(name)
+        # A prefetched builder still has the time it was started at, and the elements it builds from here on use it
+        builder.system_map.set_time(game.instance.time)
+        if incremental:
+            return builder
+        scene = builder.build()
+        solar_system_scenes.add(name, scene)
+    scene.system_map.set_time(game.instance.time)
+    return scene
+
+
+def collect_prefetched_scenes():
+    for name, sources in solar_system_prefetcher.collect():
+        add_prefetched_sources(sources)
+        if name not in solar_system_scenes and name not in solar_system_builders:
+            solar_system_builders[name] = SolarSystemSceneBuilder(name)
+
+
+def build_prefetched_scenes(budget):
+    names = replays.get_prefetched_names(None)
+    if names is not None:
+        for name in names:
+            get_solar_system_scene(name)
+        return
+    start = pt.perf_counter()
+    for name, builder in list(solar_system_builders.items()):
+        remaining = budget - (pt.perf_counter() - start)
+        if remaining <= 0.0:
+            break
+        scene = builder.build(remaining)
+        if scene is not None:
+            del solar_system_builders[name]
+            solar_system_scenes.add(name, scene)
+            replays.record_prefetched(name)
+
+
+def get_planetary_system_map(system, planet):
+    key = (system.name, planet.number)
+    system_map = planetary_system_maps.get(key)
+    if system_map is None:
+        system_map = PlanetarySystemMap(system, planet, game.instance.time)
+        planetary_system_maps.add(key, system_map)
+    else:
+        system_map.set_time(game.instance.time)
+    return system_map
+
+
 class SolarSystemMode(TrueSpaceMode):
     def __init__(self, system, autopilot_text):
-        system_map = SolarSystemMap(system, game.instance.time) if type(system) is str else system
-        super().__init__(system_map.scale, system_map, autopilot_text)
-        self.system = system_map.system
-        random.seed(helpers.deterministic_hash(self.system.name))
+        scene = get_solar_system_scene(system) if type(system) is str else system
+        super().__init__(scene.system_map.scale, scene.system_map, autopilot_text)
+        self.system = scene.system_map.system
         self.system_added = False
-        sqrt_scale = math.sqrt(self.scale)
-        for _ in range(int(200.0 / sqrt_scale)):
-            bg_scale = 0.2 * sqrt_scale * (1.0 + random.random())
-            bg_dist = max(1.0, 2.0 * (1.0 + random.random()))
-            self.background_sprites.add(backgrounds.random_truespace_background_star(bg_scale, bg_dist / self.scale))
-            self.minimap_background_sprites.add(backgrounds.random_truespace_minimap_background_star(0.5 * bg_scale))
-        self.fade = Fade(self.space.color, 1.0 / sqrt_scale)
+        self.builder = None
+        if isinstance(scene, SolarSystemSceneBuilder):
+            self.builder = scene
+            self.minimap_layer = None
+        else:
+            self.starfield = scene.starfield
+            self.minimap_layer = scene.minimap_layer
+        self.fade = Fade(self.space.color, 1.0 / math.sqrt(self.scale))
         self.set_autopilot_target()
         game.clock.tick()
 
@@ -241,6 +464,9 @@ class SolarSystemMode(TrueSpaceMode):
                 return elem
         return DummyTarget(obj.name) if helpers.contained_prefix(obj.name, data.systems.keys()) else None
 
+    def get_search_pos(self):
+        return helpers.coords_to_pos(self.system.coords)
+
     def set_autopilot_target(self):
         text = self.autopilot_text
         system_name = helpers.contained_prefix(text, data.systems.keys())
@@ -251,6 +477,7 @@ class SolarSystemMode(TrueSpaceMode):
                 planet_number = get_planet_number(system_name, planet_name)
                 planet = system.planets[planet_number - 1] if 1 <= planet_number <= len(system.planets) else None
                 if planet is not None:
+                    self.space_map.build_planet(planet_number - 1)
                     self.autopilot_target = self.get_autopilot_natural_orbiting_element(planet)
                     return
             self.autopilot_target = system
@@ -263,20 +490,31 @@ class SolarSystemMode(TrueSpaceMode):
         if not auto:
             prefix = f'{self.system.name.upper()} '
             text = self.search_text
-            planet_suffixes = get_planet_search_suffixes(self.system)
-            auto = helpers.auto_complete(text, planet_suffixes)
+            planet_suffix_index = get_planet_search_suffix_index(self.system)
+            auto = planet_suffix_index.auto_complete(text)
             if not auto:
-                planet_suffix = helpers.contained_prefix(text, planet_suffixes)
+                planet_suffix = planet_suffix_index.contained_prefix(text)
                 if planet_suffix:
                     planet_number = int(planet_suffix) if planet_suffix.isnumeric() else helpers.roman_numeral_inv_map[planet_suffix]
-                    moon_suffixes = get_moon_search_suffixes(self.system.planets[planet_number - 1])
-                    auto = helpers.auto_complete(text, moon_suffixes)
+                    auto = get_moon_search_suffix_index(self.system.planets[planet_number - 1]).auto_complete(text)
         return f'{prefix}{auto}' if auto else auto
 
+    def build_scene(self, camera):
+        # The fade stays opaque until the scene is complete, so partially built frames are never seen
+        self.fade.counter = self.fade.time
+        self.space_map.prioritize(self.player_ship.pos)
+        self.builder.set_camera(camera)
+        scene = self.builder.build(replays.get_build_budget(0.001 * game.build_budget_ms))
+        if scene is not None:
+            self.builder = None
+            self.starfield = scene.starfield
+            self.minimap_layer = scene.minimap_layer
+            solar_system_scenes.add(self.system.name, scene)
+
     def handle_event(self, event):
         return super().handle_event(event)
 
-    def update(self, pressed_keys, dt):
+    def step(self, pressed_keys, dt):
         if not self.system_added:
             game.instance.player.visited_systems.add(self.system.name.upper())
             self.system_added = True
@@ -285,112 +523,123 @@ class SolarSystemMode(TrueSpaceMode):
             self.autopilot_text = ''
             self.autopilot_target = None
 
+        ship = self.player_ship
+        ship.store_prev()
+        if self.paused or replays.is_building(self.builder is not None):
+            return self
+
+        self.advance_time(dt)
+
+        screen = game.screen
+        h_width, h_height = self.space_map.half_width, self.space_map.half_height
+        ship_half_size = 0.5 * max(ship.rect.w, ship.rect.h)
+        border_x = h_width + 0.5 * screen.display_width + ship_half_size
+        border_y = h_height + 0.5 * screen.display_height + ship_half_size
+        autopilot_pos = None
+        if self.autopilot_target is not None:
+            if isinstance(self.autopilot_target, NaturalOrbitingElement):
+                autopilot_pos = self.autopilot_target.sprite.pos
+            else:
+                vertical = border_x - abs(ship.pos[0]) > border_y - abs(ship.pos[1])
+                target_x, target_y = 1.0e6 * border_x, 1.0e6 * border_y
+                autopilot_pos = np.array([
+                    ship.pos[0] if vertical else (target_x if ship.pos[0] > 0.0 else -target_x),
+                    (target_y if ship.pos[1] > 0.0 else -target_y) if vertical else ship.pos[1],
+                ])
+        ship.update(pressed_keys, autopilot_pos, dt)
+        profiler.lap('physics')
+
+        off_cam_x = abs(ship.pos[0]) > border_x
+        off_cam_y = abs(ship.pos[1]) > border_y
+        if off_cam_x or off_cam_y:
+            pos = helpers.coords_to_pos(self.space_map.system.coords)
+            game.instance.player.set_pos_vel(pos, np.zeros(2), ship.angle, 0.0)
+            new_mode = HyperSpaceMode(self.autopilot_text)
+            # new_target = new_mode.autopilot_target
+            # if new_target is not None:
+            # diff = helpers.coords_to_pos(new_target.coords) - pos
+            # game.instance.player.angle = new_mode.player_ship.angle = np.arctan2(diff[1], diff[0])
+            profiler.lap('transition')
+            return new_mode
+
+        collision = False
+        for elem in self.space_map.elems:
+            if pg.sprite.collide_circle(ship, elem.sprite):
+                collision = True
+                if isinstance(elem, NaturalOrbitingElement) and\
+                        (self.can_collide if self.autopilot_target is None else self.autopilot_target == elem):
+                    cos, sin = math.cos(ship.angle), math.sin(ship.angle)
+                    b = abs(cos) > abs(sin)
+                    mult_x, mult_y = np.sign(cos) if b else cos, sin if b else np.sign(sin)
+                    system_map = get_planetary_system_map(self.system, elem.planet)
+                    pos_x, pos_y = -system_map.half_width * mult_x, -system_map.half_height * mult_y
+                    self.player_ship = None
+                    game.instance.player.set_pos_vel(np.array([pos_x, pos_y]), np.zeros(2), ship.angle, 0.0)
+                    new_mode = PlanetarySystemMode(self, system_map, elem.sprite.pos.copy(), self.autopilot_text)
+                    new_target = new_mode.autopilot_target
+                    if isinstance(new_target, NaturalOrbitingElement) and new_target.orbit_angle is not None:
+                        angle = helpers.positive_fmod(math.pi + new_target.orbit_angle, constants.two_pi)
+                        cos, sin = math.cos(angle), math.sin(angle)
+                        b = abs(cos) > abs(sin)
+                        mult_x, mult_y = np.sign(cos) if b else cos, sin if b else np.sign(sin)
+                        pos_x, pos_y = -system_map.half_width * mult_x, -system_map.half_height * mult_y
+                        game.instance.player.pos = new_mode.player_ship.pos = np.array([pos_x, pos_y])
+                        game.instance.player.angle = new_mode.player_ship.angle = angle
+                    profiler.lap('transition')
+                    return new_mode
+
+        if not collision:
+            self.can_collide = True
+        profiler.lap('collision')
+
+        return self
+
+    def draw(self, dt, alpha):
         screen = game.screen
         h_width, h_height = self.space_map.half_width, self.space_map.half_height
-        border_x, border_y = 0.0, 0.0
         ship = self.player_ship
 
-        if not self.paused:
-            ship_half_size = 0.5 * max(ship.rect.w, ship.rect.h)
-            border_x = h_width + 0.5 * screen.display_width + ship_half_size
-            border_y = h_height + 0.5 * screen.display_height + ship_half_size
-            autopilot_pos = None
-            if self.autopilot_target is not None:
-                if isinstance(self.autopilot_target, NaturalOrbitingElement):
-                    autopilot_pos = self.autopilot_target.sprite.pos
-                else:
-                    vertical = border_x - abs(ship.pos[0]) > border_y - abs(ship.pos[1])
-                    target_x, target_y = 1.0e6 * border_x, 1.0e6 * border_y
-                    autopilot_pos = np.array([
-                        ship.pos[0] if vertical else (target_x if ship.pos[0] > 0.0 else -target_x),
-                        (target_y if ship.pos[1] > 0.0 else -target_y) if vertical else ship.pos[1],
-                    ])
-            ship.update(pressed_keys, autopilot_pos, dt)
-
-        padded_pos = np.clip(ship.pos, [-h_width, -h_height], [h_width, h_height])
+        padded_pos = np.clip(ship.get_render_pos(alpha), [-h_width, -h_height], [h_width, h_height])
         camera = padded_pos - 0.5 * screen.display_size
 
+        if self.builder is not None:
+            self.build_scene(camera)
+            profiler.lap('build')
+
         screen.refresh()
 
-        for sprite in self.background_sprites:
-            sprite.draw(camera)
+        if self.starfield is not None:
+            self.starfield.draw(camera)
+        profiler.lap('background')
+
+        if self.builder is None:
+            self.space_map.orbit_layer.draw(camera)
+        profiler.lap('orbits')
 
         for elem in self.space_map.elems:
             elem.draw(camera, self.minimap, self.paused)
+        profiler.lap('elements')
 
         for sprite in self.npc_ships:
             sprite.draw(camera)
 
-        ship.draw(camera)
-
-        if self.minimap:
-            corner_color = np.multiply(0.5, np.add((127, 127, 127), self.space.color))
-            edge_color = np.multiply(1.2, corner_color), np.multiply(0.8, corner_color)
-            minimap_rect = screen.minimap_rect
-            border = screen.minimap_border
-            pg.draw.rect(screen.display, corner_color, minimap_rect.move(-border, border))
-            pg.draw.rect(screen.display, corner_color, minimap_rect.move(border, -border))
-            pg.draw.rect(screen.display, edge_color[0], minimap_rect.move(-border, -border))
-            pg.draw.rect(screen.display, edge_color[1], minimap_rect.move(border, border))
-            pg.draw.rect(screen.display, self.space.color, screen.minimap_rect)
+        ship.draw_interpolated(camera, alpha)
+        profiler.lap('ships')
 
-            for sprite in self.minimap_background_sprites:
-                sprite.draw(camera)
-
-            for elem in self.space_map.elems:
-                elem.minimap_draw(camera, self.paused)
+        if self.minimap and self.minimap_layer is not None:
+            self.minimap_layer.draw()
 
             for sprite in self.npc_ships:
                 sprite.minimap_draw(self.space_map.minimap_scale)
 
             ship.minimap_draw(self.space_map.minimap_scale)
-
-        if not self.paused:
-            off_cam_x = abs(ship.pos[0]) > border_x
-            off_cam_y = abs(ship.pos[1]) > border_y
-            if off_cam_x or off_cam_y:
-                pos = helpers.coords_to_pos(self.space_map.system.coords)
-                game.instance.player.set_pos_vel(pos, np.zeros(2), ship.angle, 0.0)
-                new_mode = HyperSpaceMode(self.autopilot_text)
-                # new_target = new_mode.autopilot_target
-                # if new_target is not None:
-                # diff = helpers.coords_to_pos(new_target.coords) - pos
-                # game.instance.player.angle = new_mode.player_ship.angle = np.arctan2(diff[1], diff[0])
-                return new_mode
-
-            collision = False
-            for elem in self.space_map.elems:
-                if pg.sprite.collide_circle(ship, elem.sprite):
-                    collision = True
-                    if isinstance(elem, NaturalOrbitingElement) and\
-                            (self.can_collide if self.autopilot_target is None else self.autopilot_target == elem):
-                        cos, sin = math.cos(ship.angle), math.sin(ship.angle)
-                        b = abs(cos) > abs(sin)
-                        mult_x, mult_y = np.sign(cos) if b else cos, sin if b else np.sign(sin)
-                        system_map = PlanetarySystemMap(self.system, elem.planet, game.instance.time)
-                        pos_x, pos_y = -system_map.half_width * mult_x, -system_map.half_height * mult_y
-                        self.player_ship = None
-                        game.instance.player.set_pos_vel(np.array([pos_x, pos_y]), np.zeros(2), ship.angle, 0.0)
-                        new_mode = PlanetarySystemMode(self, system_map, elem.sprite.pos.copy(), self.autopilot_text)
-                        new_target = new_mode.autopilot_target
-                        if isinstance(new_target, NaturalOrbitingElement) and new_target.orbit_angle is not None:
-                            angle = helpers.positive_fmod(math.pi + new_target.orbit_angle, constants.two_pi)
-                            cos, sin = math.cos(angle), math.sin(angle)
-                            b = abs(cos) > abs(sin)
-                            mult_x, mult_y = np.sign(cos) if b else cos, sin if b else np.sign(sin)
-                            pos_x, pos_y = -system_map.half_width * mult_x, -system_map.half_height * mult_y
-                            game.instance.player.pos = new_mode.player_ship.pos = np.array([pos_x, pos_y])
-                            game.instance.player.angle = new_mode.player_ship.angle = angle
-                        return new_mode
-
-            if not collision:
-                self.can_collide = True
+            profiler.lap('minimap')
 
         self.fade.update(dt)
+        profiler.lap('fade')
 
         self.update_search(camera)
-
-        return self
+        profiler.lap('search')
 
 
 class PlanetarySystemMode(TrueSpaceMode):
@@ -400,13 +649,13 @@ class PlanetarySystemMode(TrueSpaceMode):
         self.solar_system = self.solar_system_map.system
         if type(planet_info) is int:
             self.planet = self.solar_system.planets[planet_info - 1]
-            planetary_system_map = PlanetarySystemMap(self.solar_system, self.planet, game.instance.time)
+            planetary_system_map = get_planetary_system_map(self.solar_system, self.planet)
         else:
             self.planet = planet_info.planet
             planetary_system_map = planet_info
         super().__init__(planetary_system_map.scale, planetary_system_map, autopilot_text)
         self.system_planet_pos = system_planet_pos
-        self.background_sprites = self.solar_system_mode.background_sprites
+        self.starfield = self.solar_system_mode.starfield
         self.fade = Fade(self.space.color, 1.0)
         self.set_autopilot_target()
         game.clock.tick()
@@ -417,6 +666,9 @@ class PlanetarySystemMode(TrueSpaceMode):
                 return elem
         return DummyTarget(obj.name) if helpers.contained_prefix(obj.name, data.systems.keys()) else None
 
+    def get_search_pos(self):
+        return helpers.coords_to_pos(self.solar_system.coords)
+
     def set_autopilot_target(self):
         text = self.autopilot_text
         if text == '#p':
@@ -449,119 +701,162 @@ class PlanetarySystemMode(TrueSpaceMode):
         if not auto:
             prefix = f'{self.solar_system.name.upper()} '
             text = self.search_text
-            planet_suffixes = get_planet_search_suffixes(self.solar_system)
-            auto = helpers.auto_complete(text, planet_suffixes)
+            planet_suffix_index = get_planet_search_suffix_index(self.solar_system)
+            auto = planet_suffix_index.auto_complete(text)
             if not auto:
-                planet_suffix = helpers.contained_prefix(text, planet_suffixes)
+                planet_suffix = planet_suffix_index.contained_prefix(text)
                 if planet_suffix:
                     planet_number = int(planet_suffix) if planet_suffix.isnumeric() else helpers.roman_numeral_inv_map[planet_suffix]
                     planet = self.solar_system.planets[planet_number - 1]
-                    moon_suffixes = get_moon_search_suffixes(planet)
-                    auto = helpers.auto_complete(text, moon_suffixes)
+                    auto = get_moon_search_suffix_index(planet).auto_complete(text)
                     if not auto:
                         prefix = f'{prefix}{helpers.roman_numeral_map[self.planet.number]}-'
-                        auto = helpers.auto_complete(text, get_moon_letters(planet))
+                        auto = get_moon_letter_index(planet).auto_complete(text)
         return f'{prefix}{auto}' if auto else auto
 
     def handle_event(self, event):
         return super().handle_event(event)
 
-    def update(self, pressed_keys, dt):
+    def step(self, pressed_keys, dt):
         if self.autopilot_target is not None:
             if self.solar_system.name == self.autopilot_target.name or\
                     (self.planet.name == self.autopilot_target.name and type(self.autopilot_target) is not DummyTarget):
                 self.autopilot_text = ''
                 self.autopilot_target = None
 
-        h_width, h_height = self.space_map.half_width, self.space_map.half_height
-        border_x, border_y = 0.0, 0.0
         ship = self.player_ship
+        ship.store_prev()
+        if self.paused:
+            return self
 
-        if not self.paused:
-            ship_half_size = 0.5 * max(ship.rect.w, ship.rect.h)
-            border_x = h_width + ship_half_size
-            border_y = h_height + ship_half_size
-            autopilot_pos = None
-            if self.autopilot_target is not None:
-                if isinstance(self.autopilot_target, NaturalOrbitingElement):
-                    autopilot_pos = self.autopilot_target.sprite.pos
-                elif self.autopilot_target.name == self.planet.name:
-                    autopilot_pos = np.zeros(2)
-                else:
-                    vertical = border_x - abs(ship.pos[0]) > border_y - abs(ship.pos[1])
-                    target_x, target_y = 1.0e3 * border_x, 1.0e3 * border_y
-                    autopilot_pos = np.array([
-                        ship.pos[0] if vertical else (target_x if ship.pos[0] > 0.0 else -target_x),
-                        (target_y if ship.pos[1] > 0.0 else -target_y) if vertical else ship.pos[1],
-                    ])
-            ship.update(pressed_keys, autopilot_pos, dt)
+        self.advance_time(dt)
 
+        h_width, h_height = self.space_map.half_width, self.space_map.half_height
+        ship_half_size = 0.5 * max(ship.rect.w, ship.rect.h)
+        border_x = h_width + ship_half_size
+        border_y = h_height + ship_half_size
+        autopilot_pos = None
+        if self.autopilot_target is not None:
+            if isinstance(self.autopilot_target, NaturalOrbitingElement):
+                autopilot_pos = self.autopilot_target.sprite.pos
+            elif self.autopilot_target.name == self.planet.name:
+                autopilot_pos = np.zeros(2)
+            else:
+                vertical = border_x - abs(ship.pos[0]) > border_y - abs(ship.pos[1])
+                target_x, target_y = 1.0e3 * border_x, 1.0e3 * border_y
+                autopilot_pos = np.array([
+                    ship.pos[0] if vertical else (target_x if ship.pos[0] > 0.0 else -target_x),
+                    (target_y if ship.pos[1] > 0.0 else -target_y) if vertical else ship.pos[1],
+                ])
+        ship.update(pressed_keys, autopilot_pos, dt)
+        profiler.lap('physics')
+
+        off_cam_x = abs(ship.pos[0]) > border_x
+        off_cam_y = abs(ship.pos[1]) > border_y
+        if off_cam_x or off_cam_y:
+            self.solar_system_map.set_time(game.instance.time)
+            self.system_planet_pos = self.solar_system_map.planet_elems[self.planet.number - 1].sprite.pos.copy()
+            game.instance.player.set_pos_vel(self.system_planet_pos.copy(), np.zeros(2), ship.angle, 0.0)
+            self.solar_system_mode.reset_player()
+            self.solar_system_mode.autopilot_text = self.autopilot_text
+            self.solar_system_mode.set_autopilot_target()
+            self.solar_system_mode.fade.counter = 0.0
+            profiler.lap('transition')
+            return self.solar_system_mode
+
+        collision = False
+        for elem in self.space_map.elems:
+            if pg.sprite.collide_circle(ship, elem.sprite):
+                collision = True
+                if isinstance(elem, NaturalOrbitingElement) and \
+                        (self.can_collide if self.autopilot_target is None else self.autopilot_target.name == elem.sprite.name):
+                    self.paused = True
+                    self.autopilot_text = ''
+                    self.autopilot_target = None
+                    self.can_collide = False
+                    ship.pos = elem.sprite.pos.copy()
+                    ship.vel = np.zeros(2)
+                    ship.ang_vel = 0.0
+                    ship.store_prev()
+                    game.instance.player.set_pos_vel(ship.pos, ship.vel, ship.angle, ship.ang_vel)
+                    break
+
+        if not collision:
+            self.can_collide = True
+        profiler.lap('collision')
+
+        return self
+
+    def draw(self, dt, alpha):
         # padded_pos = np.clip(ship.pos, [-h_width, -h_height], [h_width, h_height])
         # camera = padded_pos - 0.5 * game.screen.display_size
         camera = -0.5 * game.screen.display_size
 
         game.screen.refresh()
 
-        for sprite in self.background_sprites:
-            sprite.draw(camera)
+        self.starfield.draw(camera)
+        profiler.lap('background')
+
+        self.space_map.orbit_layer.draw(camera)
+        profiler.lap('orbits')
 
         for elem in self.space_map.elems:
             elem.draw(camera, self.minimap, self.paused)
+        profiler.lap('elements')
 
         for sprite in self.npc_ships:
             sprite.draw(camera)
 
-        self.player_ship.draw(camera)
-
-        if not self.paused:
-            off_cam_x = abs(ship.pos[0]) > border_x
-            off_cam_y = abs(ship.pos[1]) > border_y
-            if off_cam_x or off_cam_y:
-                game.instance.player.set_pos_vel(self.system_planet_pos.copy(), np.zeros(2), ship.angle, 0.0)
-                self.solar_system_mode.reset_player()
-                self.solar_system_mode.autopilot_text = self.autopilot_text
-                self.solar_system_mode.set_autopilot_target()
-                self.solar_system_mode.fade.counter = 0.0
-                return self.solar_system_mode
-
-            collision = False
-            for elem in self.space_map.elems:
-                if pg.sprite.collide_circle(self.player_ship, elem.sprite):
-                    collision = True
-                    if isinstance(elem, NaturalOrbitingElement) and \
-                            (self.can_collide if self.autopilot_target is None else self.autopilot_target.name == elem.sprite.name):
-                        self.paused = True
-                        self.autopilot_text = ''
-                        self.autopilot_target = None
-                        self.can_collide = False
-                        ship.pos = elem.sprite.pos.copy()
-                        ship.vel = np.zeros(2)
-                        ship.ang_vel = 0.0
-                        game.instance.player.set_pos_vel(ship.pos, ship.vel, ship.angle, ship.ang_vel)
-                        break
-
-            if not collision:
-                self.can_collide = True
+        self.player_ship.draw_interpolated(camera, alpha)
+        profiler.lap('ships')
 
         self.fade.update(dt)
+        profiler.lap('fade')
 
         self.update_search(camera)
+        profiler.lap('search')
 
-        return self
 
+hyperspace_map = None
+hyperspace_starfield = None
 
-class HyperSpaceMode(SpaceMode):
-    def __init__(self, autopilot_text):
-        super().__init__(1.0, spaces.hyperspace, HyperSpaceMap(), autopilot_text)
-        random.seed(hash(game.instance))
+
+def get_hyperspace_map():
+    global hyperspace_map
+    if hyperspace_map is None:
+        hyperspace_map = HyperSpaceMap()
+    return hyperspace_map
+
+
+def get_hyperspace_starfield(scale):
+    global hyperspace_starfield
+    if hyperspace_starfield is None:
+        background_sprites = []
         for _ in range(200):
             bg_scale = 0.25 * (1.0 + random.random())
             bg_dist = 0.5 * (1.0 + random.random())
-            bg_star = backgrounds.random_hyperspace_background_star(bg_scale, bg_dist / self.scale)
-            self.background_sprites.add(bg_star)
+            background_sprites.append(backgrounds.random_hyperspace_background_star(bg_scale, bg_dist / scale))
+        hyperspace_starfield = backgrounds.Starfield(background_sprites)
+    return hyperspace_starfield
+
+
+class HyperSpaceMode(SpaceMode):
+    def __init__(self, autopilot_text):
+        super().__init__(1.0, spaces.hyperspace, get_hyperspace_map(), autopilot_text)
+        self.npc_ships = Fleet(self.space)
+        random.seed(replays.get_seed(hash(game.instance)))
+        self.starfield = get_hyperspace_starfield(self.scale)
+        self.prefetch = True
+        self.prefetch_interval = 0.25
+        self.prefetch_horizon = 4.0
+        self.prefetch_count = 2
+        self.prefetch_counter = 0.0
         self.set_autopilot_target()
         game.clock.tick()
 
+    def get_search_pos(self):
+        return self.player_ship.pos
+
     def set_autopilot_target(self):
         self.autopilot_target = data.systems.get(helpers.contained_prefix(self.autopilot_text, data.systems.keys()))
 
@@ -571,6 +866,45 @@ class HyperSpaceMode(SpaceMode):
     def handle_event(self, event):
         return super().handle_event(event)
 
+    def get_prefetch_names(self):
+        ship = self.player_ship
+        names = []
+        if self.autopilot_target is not None:
+            names.append(self.autopilot_target.name)
+
+        speed = math.hypot(ship.vel[0], ship.vel[1])
+        heading = ship.dir if speed == 0.0 else ship.vel / speed
+        radius = max(game.screen.display_max_dim, self.prefetch_horizon * speed)
+        table = data.system_table
+        ids = table.within(ship.pos, radius)
+        if len(ids):
+            offsets = table.pos[ids] - ship.pos
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+            ahead = offsets @ heading > 0.5 * distances
+            ids, distances = ids[ahead], distances[ahead]
+            for system_id in ids[np.argsort(distances)]:
+                if len(names) >= self.prefetch_count:
+                    break
+                name = table.names[system_id]
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def update_prefetch(self, dt):
+        collect_prefetched_scenes()
+        self.prefetch_counter -= dt
+        if self.prefetch_counter > 0.0:
+            return
+        self.prefetch_counter = self.prefetch_interval
+        names = [x for x in self.get_prefetch_names() if x not in solar_system_scenes]
+        solar_system_prefetcher.retain(names)
+        for name in list(solar_system_builders):
+            if name not in names:
+                del solar_system_builders[name]
+        for name in names:
+            if name not in solar_system_builders:
+                solar_system_prefetcher.request(name)
+
     def spawn_npc_ship(self):
         ship_pos = self.player_ship.pos
         for race in helpers.each(data.race_list, random.randrange(0, len(data.race_list))):
@@ -587,94 +921,108 @@ class HyperSpaceMode(SpaceMode):
                 self.npc_ships.add(ship)
                 break
 
-    def update(self, pressed_keys, dt):
+    def step(self, pressed_keys, dt):
         ship = self.player_ship
-        if not self.paused:
-            autopilot_pos = None if self.autopilot_target is None else helpers.coords_to_pos(self.autopilot_target.coords)
-            ship.update(pressed_keys, autopilot_pos, dt)
+        ship.store_prev()
+        if self.paused:
+            self.npc_ships.store_prev()
+            return self
 
-        camera = ship.pos - 0.5 * game.screen.display_size
+        self.advance_time(dt)
 
-        game.screen.refresh()
+        for npc_ship in self.npc_ships_remove:
+            self.npc_ships.remove(npc_ship)
+        self.npc_ships_remove.clear()
 
-        if not self.paused and random.random() < 0.1 * dt:
+        autopilot_pos = None if self.autopilot_target is None else helpers.coords_to_pos(self.autopilot_target.coords)
+        ship.update(pressed_keys, autopilot_pos, dt)
+        profiler.lap('physics')
+
+        if self.prefetch:
+            self.update_prefetch(dt)
+        profiler.lap('prefetch')
+
+        if random.random() < 0.1 * dt:
             # self.spawn_npc_ship()
             pass
 
-        for sprite in self.background_sprites:
-            sprite.draw(camera)
+        self.npc_ships.update(ship.pos, dt)
+        self.npc_ships.cull(ship.pos, 2.0 * game.screen.display_max_dim)
+        profiler.lap('npcs')
+
+        collision = False
+        for elem in self.space_map.get_nearby_elems(ship):
+            if pg.sprite.collide_circle(ship, elem.sprite):
+                collision = True
+                if isinstance(elem, HyperSpaceSystemElement) and\
+                        (self.can_collide if self.autopilot_target is None else self.autopilot_target.name == elem.name):
+                    angle = ship.angle
+                    cos, sin = math.cos(angle), math.sin(angle)
+                    b = abs(cos) > abs(sin)
+                    mult_x, mult_y = np.sign(cos) if b else cos, sin if b else np.sign(sin)
+                    scene = get_solar_system_scene(elem.name, True)
+                    system_map = scene.system_map
+                    pos_x = -(system_map.half_width + 0.25 * game.screen.display_width) * mult_x
+                    pos_y = -(system_map.half_height + 0.25 * game.screen.display_height) * mult_y
+                    game.instance.player.set_pos_vel(np.array([pos_x, pos_y]), np.zeros(2), angle, 0.0)
+                    new_mode = SolarSystemMode(scene, self.autopilot_text)
+                    new_target = new_mode.autopilot_target
+                    if isinstance(new_target, NaturalOrbitingElement) and new_target.orbit_angle is not None:
+                        angle = helpers.positive_fmod(math.pi + new_target.orbit_angle, constants.two_pi)
+                        cos, sin = math.cos(angle), math.sin(angle)
+                        b = abs(cos) > abs(sin)
+                        mult_x, mult_y = np.sign(cos) if b else cos, sin if b else np.sign(sin)
+                        pos_x = -(system_map.half_width + 0.25 * game.screen.display_width) * mult_x
+                        pos_y = -(system_map.half_height + 0.25 * game.screen.display_height) * mult_y
+                        game.instance.player.pos = new_mode.player_ship.pos = np.array([pos_x, pos_y])
+                        game.instance.player.angle = new_mode.player_ship.angle = angle
+                    profiler.lap('transition')
+                    return new_mode
+
+        for npc_ship in self.npc_ships.get_nearby(ship.pos, 0.5 * math.hypot(ship.rect.w, ship.rect.h)):
+            if pg.sprite.collide_rect(ship, npc_ship):
+                player_mask = images.masks.get(ship.image)
+                npc_mask = images.masks.get(npc_ship.image)
+                if player_mask.overlap(npc_mask, npc_ship.pos - ship.pos):
+                    collision = True
+                    if self.can_collide:
+                        self.paused = True
+                        self.can_collide = False
+                        ship.vel = np.zeros(2)
+                        ship.ang_vel = 0.0
+                        game.instance.player.set_pos_vel(ship.pos, ship.vel, ship.angle, ship.ang_vel)
+                        self.npc_ships_remove.add(npc_ship)
+                        break
 
-        for elem in self.space_map.elems:
-            elem.draw(camera, self.minimap, self.paused)
+        if not collision:
+            self.can_collide = True
+        profiler.lap('collision')
 
-        if not self.paused:
-            removed = set()
+        return self
 
-            for sprite in self.npc_ships:
-                sprite.update(None, ship.pos, dt)
-                if np.linalg.norm(ship.pos - sprite.pos) > 2.0 * game.screen.display_max_dim:
-                    removed.add(sprite)
+    def draw(self, dt, alpha):
+        ship = self.player_ship
+        camera = ship.get_render_pos(alpha) - 0.5 * game.screen.display_size
 
-            for sprite in removed:
-                self.npc_ships.remove(sprite)
+        # Prefetched scenes are built here, within the same per-frame budget as a scene entered before it was ready
+        build_prefetched_scenes(0.001 * game.build_budget_ms)
+        profiler.lap('build')
 
-        for sprite in self.npc_ships:
-            sprite.draw(camera)
+        game.screen.refresh()
 
-        ship.draw(camera)
+        self.starfield.draw(camera)
+        profiler.lap('background')
 
-        if not self.paused:
-            for npc_ship in self.npc_ships_remove:
-                self.npc_ships.remove(npc_ship)
-            self.npc_ships_remove.clear()
+        for elem in self.space_map.get_visible_elems(camera):
+            elem.draw(camera, self.minimap, self.paused)
+        profiler.lap('elements')
 
-            collision = False
-            for elem in self.space_map.elems:
-                if pg.sprite.collide_circle(ship, elem.sprite):
-                    collision = True
-                    if isinstance(elem, HyperSpaceSystemElement) and\
-                            (self.can_collide if self.autopilot_target is None else self.autopilot_target.name == elem.name):
-                        angle = ship.angle
-                        cos, sin = math.cos(angle), math.sin(angle)
-                        b = abs(cos) > abs(sin)
-                        mult_x, mult_y = np.sign(cos) if b else cos, sin if b else np.sign(sin)
-                        system_map = SolarSystemMap(elem.name, game.instance.time)
-                        pos_x = -(system_map.half_width + 0.25 * game.screen.display_width) * mult_x
-                        pos_y = -(system_map.half_height + 0.25 * game.screen.display_height) * mult_y
-                        game.instance.player.set_pos_vel(np.array([pos_x, pos_y]), np.zeros(2), angle, 0.0)
-                        new_mode = SolarSystemMode(system_map, self.autopilot_text)
-                        new_target = new_mode.autopilot_target
-                        if isinstance(new_target, NaturalOrbitingElement) and new_target.orbit_angle is not None:
-                            angle = helpers.positive_fmod(math.pi + new_target.orbit_angle, constants.two_pi)
-                            cos, sin = math.cos(angle), math.sin(angle)
-                            b = abs(cos) > abs(sin)
-                            mult_x, mult_y = np.sign(cos) if b else cos, sin if b else np.sign(sin)
-                            pos_x = -(system_map.half_width + 0.25 * game.screen.display_width) * mult_x
-                            pos_y = -(system_map.half_height + 0.25 * game.screen.display_height) * mult_y
-                            game.instance.player.pos = new_mode.player_ship.pos = np.array([pos_x, pos_y])
-                            game.instance.player.angle = new_mode.player_ship.angle = angle
-                        return new_mode
-
-            for npc_ship in self.npc_ships:
-                if pg.sprite.collide_rect(ship, npc_ship):
-                    player_mask = pg.mask.from_surface(ship.image)
-                    npc_mask = pg.mask.from_surface(npc_ship.image)
-                    if player_mask.overlap(npc_mask, npc_ship.pos - ship.pos):
-                        collision = True
-                        if self.can_collide:
-                            self.paused = True
-                            self.can_collide = False
-                            ship.vel = np.zeros(2)
-                            ship.ang_vel = 0.0
-                            game.instance.player.set_pos_vel(ship.pos, ship.vel, ship.angle, ship.ang_vel)
-                            self.npc_ships_remove.add(npc_ship)
-                            break
-
-            if not collision:
-                self.can_collide = True
+        self.npc_ships.draw(camera, alpha)
+
+        ship.draw_interpolated(camera, alpha)
+        profiler.lap('ships')
 
         # self.fade.update(dt)
 
         self.update_search(camera)
-
-        return self
+        profiler.lap('search')
@@ -0,0 +1,46 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher:
+    def __init__(self, build, max_pending=4):
+        self.build = build
+        self.max_pending = max_pending
+        self.executor = None
+        self.futures = {}
+
+    def __contains__(self, key):
+        return key in self.futures
+
+    def request(self, key):
+        if key in self.futures or len(self.futures) >= self.max_pending:
+            return False
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.futures[key] = self.executor.submit(self.build, key)
+        return True
+
+    def retain(self, keys):
+        for key, future in list(self.futures.items()):
+            if key not in keys and future.cancel():
+                del self.futures[key]
+
+    def collect(self):
+        results = []
+        for key, future in list(self.futures.items()):
+            if future.done():
+                del self.futures[key]
+                if not future.cancelled() and future.exception() is None:
+                    results.append((key, future.result()))
+        return results
+
+    def take(self, key):
+        future = self.futures.pop(key, None)
+        if future is None or future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        self.futures.clear()
@@ -0,0 +1,142 @@
+import csv
+import numpy as np
+import pygame as pg
+import time as pt
+
+import game
+
+from collections import deque
+
+
+phases = (
+    'input', 'build', 'physics', 'prefetch', 'npcs', 'transition', 'collision',
+    'background', 'orbits', 'elements', 'ships', 'minimap', 'fade', 'search', 'overlay', 'flip',
+)
+
+enabled = False
+overlay = False
+enabled_by_overlay = False
+window = 600
+overlay_interval = 30
+
+samples = {}
+frame_times = {}
+frame_start = 0.0
+last_time = 0.0
+frame_number = 0
+csv_file = None
+csv_writer = None
+font = None
+overlay_surface = None
+
+
+def set_enabled(value):
+    global enabled, frame_start, last_time
+    enabled = value
+    frame_start = last_time = pt.perf_counter()
+    frame_times.clear()
+
+
+def toggle_overlay():
+    global overlay, overlay_surface, enabled_by_overlay
+    overlay = not overlay
+    overlay_surface = None
+    if overlay and not enabled:
+        set_enabled(True)
+        enabled_by_overlay = True
+    elif not overlay and enabled_by_overlay:
+        # Profiling turned on for the overlay stops with it, unless a CSV log still needs the timings
+        enabled_by_overlay = False
+        if csv_file is None:
+            set_enabled(False)
+
+
+def open_csv(path):
+    global csv_file, csv_writer
+    close_csv()
+    csv_file = open(path, 'w', newline='')
+    csv_writer = csv.writer(csv_file)
+    csv_writer.writerow(('frame', 'mode', 'dt', 'total') + phases)
+    set_enabled(True)
+
+
+def close_csv():
+    global csv_file, csv_writer
+    if csv_file is not None:
+        csv_file.close()
+        csv_file = csv_writer = None
+
+
+def start_frame():
+    global frame_start, last_time
+    if not enabled:
+        return
+    frame_start = last_time = pt.perf_counter()
+    frame_times.clear()
+
+
+def lap(name):
+    # Attributes the time since the previous lap to the named phase; a no-op unless profiling is enabled
+    global last_time
+    if not enabled:
+        return
+    now = pt.perf_counter()
+    frame_times[name] = frame_times.get(name, 0.0) + now - last_time
+    last_time = now
+
+
+def end_frame(mode, dt):
+    global frame_number
+    if not enabled:
+        return
+    frame_times['total'] = pt.perf_counter() - frame_start
+    for name, value in frame_times.items():
+        phase_samples = samples.get(name)
+        if phase_samples is None:
+            phase_samples = samples[name] = deque(maxlen=window)
+        phase_samples.append(value)
+
+    if csv_writer is not None:
+        row = [frame_number, type(mode).__name__, f'{1000.0 * dt:.3f}', f'{1000.0 * frame_times["total"]:.3f}']
+        row.extend(f'{1000.0 * frame_times.get(x, 0.0):.3f}' for x in phases)
+        csv_writer.writerow(row)
+    frame_number += 1
+
+
+def get_percentiles(name):
+    phase_samples = samples.get(name)
+    if not phase_samples:
+        return None
+    return 1000.0 * np.percentile(np.fromiter(phase_samples, float, len(phase_samples)), (50.0, 95.0, 99.0))
+
+
+def get_stats():
+    return {name: get_percentiles(name).tolist() for name in samples}
+
+
+def build_overlay_surface():
+    global font
+    if font is None:
+        font = pg.font.SysFont('Consolas', 16)
+    lines = [f'{"phase":<12}{"p50":>8}{"p95":>8}{"p99":>8}']
+    for name in ('total',) + phases:
+        percentiles = get_percentiles(name)
+        if percentiles is not None:
+            lines.append(f'{name:<12}{percentiles[0]:8.2f}{percentiles[1]:8.2f}{percentiles[2]:8.2f}')
+    line_surfaces = [font.render(x, True, (255, 255, 255)) for x in lines]
+    line_height = font.get_linesize()
+    surface = pg.Surface((max(x.get_width() for x in line_surfaces) + 16, line_height * len(lines) + 16))
+    surface.set_alpha(191)
+    for i, line_surface in enumerate(line_surfaces):
+        surface.blit(line_surface, (8, 8 + i * line_height))
+    return surface
+
+
+def draw():
+    global overlay_surface
+    if not overlay:
+        return
+    # Percentiles change slowly, so the text is only re-rendered every few frames
+    if overlay_surface is None or frame_number % overlay_interval == 0:
+        overlay_surface = build_overlay_surface()
+    game.screen.draw(overlay_surface, (8, 8))
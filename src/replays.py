@@ -0,0 +1,256 @@
+import argparse
+import gzip
+import json
+import os
+import random
+import time
+
+import numpy as np
+import pygame as pg
+
+import data
+import game
+import jit
+import profiler
+
+from collections import deque
+
+
+version = 2
+recorded_event_types = {pg.KEYDOWN, pg.KEYUP}
+flush_interval = 600
+
+recorder = None
+player = None
+
+
+class Recorder:
+    def __init__(self, path):
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.start = game.start
+        self.random_seed = int.from_bytes(os.urandom(4), 'little')
+        random.seed(self.random_seed)
+        self.seeds = []
+        self.prefetched = []
+        self.pressed = None
+        self.frame_count = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')))
+        self.file.write('\n')
+
+    def write_header(self):
+        self.write({
+            'version': version,
+            'display_size': list(game.screen.display.get_size()),
+            'tick_rate': game.tick_rate,
+            'time_scale': game.time_scale,
+            'max_catch_up_steps': game.max_catch_up_steps,
+            'build_budget_ms': game.build_budget_ms,
+            'start': self.start,
+            'random_seed': self.random_seed,
+            'seeds': self.seeds,
+            'save': game.get_save_lines(),
+        })
+        self.seeds = []
+
+    def write_frame(self, dt, events, pressed_keys):
+        # Only what changed is written; a frame with no input is just its dt
+        record = {'d': dt}
+        events = [[x.type, getattr(x, 'key', 0), getattr(x, 'mod', 0), getattr(x, 'unicode', ''), getattr(x, 'scancode', 0)]
+                  for x in events if x.type in recorded_event_types]
+        if events:
+            record['e'] = events
+        pressed = [i for i, x in enumerate(pressed_keys) if x]
+        if pressed != self.pressed:
+            record['k'] = pressed
+            self.pressed = pressed
+        if getattr(game.instance.mode, 'builder', None) is not None:
+            record['b'] = 1
+        if self.prefetched:
+            record['p'] = self.prefetched
+            self.prefetched = []
+        if self.seeds:
+            record['s'] = self.seeds
+            self.seeds = []
+        self.write(record)
+
+        self.frame_count += 1
+        if self.frame_count % flush_interval == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Player:
+    def __init__(self, path):
+        self.file = gzip.open(path, 'rt', encoding='utf-8')
+        self.header = json.loads(self.file.readline())
+        if self.header['version'] != version:
+            raise ValueError(f'Unsupported replay version {self.header["version"]}')
+        self.seeds = deque(self.header['seeds'])
+        self.building = False
+        self.was_building = False
+        self.prefetched = ()
+
+    def get_frames(self):
+        for line in self.file:
+            yield json.loads(line)
+
+    def close(self):
+        self.file.close()
+
+
+def start_recording(path):
+    global recorder
+    recorder = Recorder(path)
+
+
+def write_header():
+    if recorder is not None:
+        recorder.write_header()
+
+
+def record_frame(dt, events, pressed_keys):
+    if recorder is not None:
+        recorder.write_frame(dt, events, pressed_keys)
+
+
+def stop_recording():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+
+
+def get_seed(default):
+    if player is not None and player.seeds:
+        return player.seeds.popleft()
+    if recorder is not None:
+        recorder.seeds.append(default)
+    return default
+
+
+def get_build_budget(default):
+    # Scene builds are sliced by wall-clock time, so playback follows the recorded frames instead
+    if player is None:
+        return default
+    return 0.0 if player.building else None
+
+
+def is_building(default):
+    # Whether a scene was still being built at the end of the previous frame, which holds the simulation
+    if player is None:
+        return default
+    return player.was_building
+
+
+def get_prefetched_names(default):
+    # Prefetched scenes are built in wall-clock time slices too, so playback finishes them on the recorded frames instead
+    if player is None:
+        return default
+    return player.prefetched
+
+
+def record_prefetched(name):
+    if recorder is not None:
+        recorder.prefetched.append(name)
+
+
+def get_pressed_keys(pressed, key_count):
+    keys = [False] * key_count
+    for i in pressed:
+        keys[i] = True
+    return pg.key.ScancodeWrapper(keys)
+
+
+def get_event(record):
+    event_type, key, mod, unicode, scancode = record
+    return pg.event.Event(event_type, key=key, mod=mod, unicode=unicode, scancode=scancode)
+
+
+def play(path, realtime=False):
+    global player
+    player = Player(path)
+    header = player.header
+
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pg.init()
+    data.load()
+    jit.warm_up()
+    game.tick_rate = header['tick_rate']
+    game.time_scale = header['time_scale']
+    game.max_catch_up_steps = header['max_catch_up_steps']
+    game.build_budget_ms = header['build_budget_ms']
+    game.start = header['start']
+    random.seed(header['random_seed'])
+    game.init(tuple(header['display_size']), '__replay__', header['save'])
+
+    key_count = len(pg.key.get_pressed())
+    pressed_keys = get_pressed_keys((), key_count)
+    accumulator = 0.0
+    recorded_time = 0.0
+    frame_times = []
+    start = time.perf_counter()
+    for frame in player.get_frames():
+        frame_start = time.perf_counter()
+        dt = frame['d']
+        recorded_time += dt
+        player.seeds.extend(frame.get('s', ()))
+        player.was_building = player.building
+        player.building = 'b' in frame
+        player.prefetched = frame.get('p', ())
+        if 'k' in frame:
+            pressed_keys = get_pressed_keys(frame['k'], key_count)
+        events = [get_event(x) for x in frame.get('e', ())]
+
+        profiler.start_frame()
+        accumulator = game.run_frame(dt, events, pressed_keys, accumulator)
+        elapsed = time.perf_counter() - frame_start
+        frame_times.append(elapsed)
+        if realtime and elapsed < dt:
+            time.sleep(dt - elapsed)
+
+    result = {
+        'frames': len(frame_times),
+        'wall_time': time.perf_counter() - start,
+        'recorded_time': recorded_time,
+        'frame_times': None,
+        'final_state': game.get_save_lines(),
+    }
+    if frame_times:
+        times_ms = 1000.0 * np.array(frame_times)
+        p50, p95, p99 = np.percentile(times_ms, (50.0, 95.0, 99.0))
+        result['frame_times'] = {'mean': float(times_ms.mean()), 'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(times_ms.max())}
+    if profiler.enabled:
+        result['phases'] = profiler.get_stats()
+
+    player.close()
+    player = None
+    game.solar_system_prefetcher.shutdown()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='replay file written by main.py --record')
+    parser.add_argument('--realtime', action='store_true', help='pace playback by the recorded frame times instead of running flat out')
+    parser.add_argument('--profile', action='store_true', help='collect per-phase timings with the frame profiler')
+    parser.add_argument('--profile-csv', metavar='PATH', help='write per-frame phase timings to a CSV file')
+    parser.add_argument('--output', help='write the JSON summary to this file instead of stdout')
+    args = parser.parse_args()
+
+    if args.profile_csv:
+        profiler.open_csv(args.profile_csv)
+    elif args.profile:
+        profiler.set_enabled(True)
+    summary = play(args.path, args.realtime)
+    profiler.close_csv()
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(summary, file, indent=4)
+    else:
+        print(json.dumps(summary, indent=4))
+    pg.quit()
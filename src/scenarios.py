@@ -0,0 +1,342 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pygame as pg
+
+import data
+import game
+import helpers
+import jit
+import modes
+import profiler
+
+
+class ScriptedKeys:
+    def __init__(self, keys=()):
+        self.keys = set(keys)
+
+    def __getitem__(self, key):
+        return key in self.keys
+
+
+def init_headless(display_size):
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    pg.init()
+    data.load()
+    jit.warm_up()
+    game.start = False
+    # A save that does not exist, so every run starts from the default new game and nothing is overwritten
+    game.init(display_size, '__scenarios__')
+
+
+def get_rss():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (EnvironmentError, ValueError, AttributeError):
+        return None
+
+
+def get_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else 1024 * peak
+
+
+def get_distribution(times):
+    if not times:
+        return None
+    times_ms = 1000.0 * np.array(times)
+    p50, p95, p99 = np.percentile(times_ms, (50.0, 95.0, 99.0))
+    return {
+        'frames': len(times),
+        'mean': float(times_ms.mean()),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+        'max': float(times_ms.max()),
+    }
+
+
+def key_event(key, unicode=''):
+    return pg.event.Event(pg.KEYDOWN, key=key, unicode=unicode, mod=0)
+
+
+max_leg_time = 120.0
+
+
+class Flight:
+    def __init__(self, mode, dt):
+        self.mode = mode
+        self.dt = dt
+        self.accumulator = 0.0
+        self.pressed_keys = ScriptedKeys()
+        self.frame_times = []
+        self.transitions = []
+        self.settling = None
+        self.peak_rss = get_rss()
+        game.instance.mode = mode
+        profiler.samples.clear()
+
+    def frame(self, events=()):
+        start = time.perf_counter()
+        profiler.start_frame()
+        mode = self.mode
+        for event in events:
+            mode = mode.handle_event(event)
+        profiler.lap('input')
+        new_mode, self.accumulator, alpha = game.advance(mode, self.pressed_keys, self.accumulator + self.dt, 1.0 / game.tick_rate)
+        new_mode.draw(self.dt, alpha)
+        pg.display.flip()
+        profiler.lap('flip')
+        profiler.end_frame(new_mode, self.dt)
+        elapsed = time.perf_counter() - start
+
+        frame_number = len(self.frame_times)
+        self.frame_times.append(elapsed)
+        if new_mode is not self.mode:
+            transition = {'from': type(self.mode).__name__, 'to': type(new_mode).__name__, 'frame': frame_number, 'latency': 1000.0 * elapsed}
+            self.transitions.append(transition)
+            self.settling = (transition, start)
+        # Scenes built incrementally keep the fade opaque for a few frames, which counts towards the transition
+        if self.settling is not None and getattr(new_mode, 'builder', None) is None:
+            transition, transition_start = self.settling
+            transition['settle_frames'] = frame_number - transition['frame'] + 1
+            transition['settle_latency'] = 1000.0 * (time.perf_counter() - transition_start)
+            self.settling = None
+
+        self.mode = game.instance.mode = new_mode
+        rss = get_rss()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+        return new_mode
+
+    def fly_leg(self, until):
+        # Legs are limited in simulated time rather than by --frames, since how long the autopilot needs does not depend on it
+        return self.fly(round(max_leg_time / self.dt), until)
+
+    def fly(self, max_frames, until=None):
+        for _ in range(max_frames):
+            self.frame()
+            if until is not None and until(self.mode):
+                return True
+        return until is None
+
+    def get_report(self, completed):
+        return {
+            'completed': completed,
+            'frame_times': get_distribution(self.frame_times),
+            'transitions': self.transitions,
+            'peak_rss': self.peak_rss,
+            'phases': profiler.get_stats(),
+        }
+
+
+def is_settled(mode_type):
+    return lambda mode: type(mode) is mode_type and getattr(mode, 'builder', None) is None
+
+
+def start_hyperspace(pos, angle, autopilot_text):
+    game.instance.player.set_pos_vel(pos, np.zeros(2), angle, 0.0)
+    return modes.HyperSpaceMode(autopilot_text)
+
+
+def start_solar_system(system, pos, autopilot_text):
+    game.instance.player.set_pos_vel(pos, np.zeros(2), 0.0, 0.0)
+    return modes.SolarSystemMode(system.name, autopilot_text)
+
+
+def place_ship(mode, pos, angle):
+    # Scripted jumps keep the flights short; the autopilot covers the rest of each leg
+    game.instance.player.set_pos_vel(pos, np.zeros(2), angle, 0.0)
+    mode.reset_player()
+
+
+def get_edge_pos(system):
+    system_map = modes.get_solar_system_scene(system.name).system_map
+    return np.array([-system_map.half_width, 0.0])
+
+
+def get_planet_pos(system, planet_number):
+    system_map = modes.get_solar_system_scene(system.name).system_map
+    return system_map.planet_elems[planet_number - 1].sprite.pos.copy()
+
+
+def run_hyperspace_cruise(system, dt, frames):
+    flight = Flight(start_hyperspace(helpers.coords_to_pos(system.coords), 0.0, ''), dt)
+    flight.pressed_keys = ScriptedKeys((pg.K_UP,))
+    return flight.get_report(flight.fly(frames))
+
+
+def run_system_entry(system, dt, frames, prefetch=True):
+    modes.solar_system_scenes.clear()
+    modes.solar_system_builders.clear()
+    pos = helpers.coords_to_pos(system.coords) + np.array([3000.0, 0.0])
+    flight = Flight(start_hyperspace(pos, np.pi, system.name), dt)
+    flight.mode.prefetch = prefetch
+    completed = flight.fly_leg(is_settled(modes.SolarSystemMode))
+    flight.fly(frames)
+    return flight.get_report(completed)
+
+
+def run_cold_system_entry(system, dt, frames):
+    return run_system_entry(system, dt, frames, False)
+
+
+def get_dive_planet_number(system):
+    return len(system.planets) // 2 + 1
+
+
+def run_planet_dive(system, dt, frames):
+    planet_number = get_dive_planet_number(system)
+    planet_name = modes.get_planet_names(system)[planet_number - 1]
+    # Starting next to the planet keeps the dive short; the autopilot still has to turn and approach it
+    pos = get_planet_pos(system, planet_number) + np.array([0.25 * game.screen.display_width, 0.0])
+    flight = Flight(start_solar_system(system, pos, planet_name), dt)
+    completed = flight.fly_leg(is_settled(modes.PlanetarySystemMode))
+    flight.fly(frames)
+    return flight.get_report(completed)
+
+
+def run_planet_exit(system, dt, frames):
+    planet_number = get_dive_planet_number(system)
+    planet_pos = get_planet_pos(system, planet_number)
+    # Any other system as the target sends the ship out across both the planetary and the solar system border
+    other_name = next(x for x in data.systems if x != system.name)
+    mode = modes.PlanetarySystemMode(system.name, planet_number, planet_pos, other_name)
+    place_ship(mode, np.array([game.screen.display_width - mode.space_map.half_width, 0.0]), np.pi)
+    flight = Flight(mode, dt)
+    completed = flight.fly_leg(is_settled(modes.SolarSystemMode))
+    if completed:
+        place_ship(flight.mode, get_edge_pos(system) + np.array([game.screen.display_width, 0.0]), np.pi)
+        completed = flight.fly_leg(is_settled(modes.HyperSpaceMode))
+    flight.fly(frames)
+    return flight.get_report(completed)
+
+
+def enter_system(system, autopilot_text, dt):
+    # Starts on top of the system, so the ship enters it on the first step
+    flight = Flight(start_hyperspace(helpers.coords_to_pos(system.coords), 0.0, autopilot_text), dt)
+    flight.fly_leg(lambda mode: type(mode) is modes.SolarSystemMode)
+    return flight
+
+
+def run_late_entry(system, dt, frames):
+    # A scene prefetched long before the system is entered has to place the ship from the time of entry
+    planet_number = get_dive_planet_number(system)
+    planet_name = modes.get_planet_names(system)[planet_number - 1]
+    prefetch_time = game.instance.time
+    entry_time = prefetch_time + 50.0
+    modes.solar_system_scenes.clear()
+    modes.solar_system_builders.clear()
+    game.instance.time = entry_time
+    expected_pos = enter_system(system, planet_name, dt).mode.player_ship.pos.copy()
+
+    modes.solar_system_scenes.clear()
+    game.instance.time = prefetch_time
+    builder = modes.SolarSystemSceneBuilder(system.name)
+    while builder.system_map.build_next():
+        pass
+    modes.solar_system_builders[system.name] = builder
+    game.instance.time = entry_time
+    flight = enter_system(system, planet_name, dt)
+    pos = flight.mode.player_ship.pos.copy()
+    flight.fly(frames)
+    report = flight.get_report(bool(np.allclose(pos, expected_pos)))
+    report['entry_pos'] = pos.tolist()
+    report['expected_entry_pos'] = expected_pos.tolist()
+    return report
+
+
+def run_search_overlay(system, dt, frames):
+    flight = Flight(start_solar_system(system, get_edge_pos(system), ''), dt)
+    flight.frame([key_event(pg.K_F6)])
+    text = f'{system.name.upper()} I'
+    typed = 0
+    for i in range(frames):
+        events = []
+        if i % 10 == 0:
+            # Types the text out, then erases it, so both the prefix and the fuzzy paths are exercised
+            if typed < len(text):
+                events.append(key_event(pg.K_a, text[typed]))
+                typed += 1
+            else:
+                events.append(key_event(pg.K_DELETE))
+                typed = 0
+        flight.frame(events)
+    completed = flight.mode.searching
+    flight.frame([key_event(pg.K_ESCAPE)])
+    return flight.get_report(completed)
+
+
+scenarios = {
+    'hyperspace_cruise': run_hyperspace_cruise,
+    'system_entry': run_system_entry,
+    'cold_system_entry': run_cold_system_entry,
+    'planet_dive': run_planet_dive,
+    'planet_exit': run_planet_exit,
+    'late_entry': run_late_entry,
+    'search_overlay': run_search_overlay,
+}
+
+
+def warm_up(system, dt):
+    # Loads the shared images and fills the scene caches, which would otherwise land in the first scenario
+    Flight(start_hyperspace(helpers.coords_to_pos(system.coords), 0.0, ''), dt).fly(30)
+    Flight(start_solar_system(system, get_edge_pos(system), ''), dt).fly(30)
+
+
+def run(names, system_name, display_size, dt, frames):
+    init_headless(display_size)
+    profiler.set_enabled(True)
+    system = data.systems[system_name]
+    start = time.perf_counter()
+    warm_up(system, dt)
+    results = {
+        'display_size': list(game.screen.display.get_size()),
+        'system': system_name,
+        'dt': dt,
+        'tick_rate': game.tick_rate,
+        'warm_up': time.perf_counter() - start,
+        'jit': jit.get_stats(),
+        'scenarios': {},
+    }
+    for name in names:
+        start = time.perf_counter()
+        result = scenarios[name](system, dt, frames)
+        result['wall_time'] = time.perf_counter() - start
+        results['scenarios'][name] = result
+    results['peak_rss'] = get_peak_rss()
+    modes.solar_system_prefetcher.shutdown()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scenarios', nargs='*', help=f'scenarios to run, from {", ".join(scenarios)} (default: all)')
+    parser.add_argument('--system', default='Beta Arae', help='dense system to enter, dive into and search for')
+    parser.add_argument('--resolution', default='1280x720', help='virtual display resolution, WIDTHxHEIGHT')
+    parser.add_argument('--dt', type=float, default=1.0 / 60.0, help='simulated frame time in seconds')
+    parser.add_argument('--frames', type=int, default=300, help='frames to hold each scenario for')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    for name in args.scenarios:
+        if name not in scenarios:
+            parser.error(f'unknown scenario {name!r}')
+    resolution = tuple(int(x) for x in args.resolution.lower().split('x'))
+    report = run(args.scenarios or list(scenarios.keys()), args.system, resolution, args.dt, args.frames)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+    pg.quit()
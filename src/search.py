@@ -0,0 +1,121 @@
+import numpy as np
+import os
+
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+
+class PrefixIndex:
+    def __init__(self, names):
+        self.names = sorted(set(names))
+        self.name_set = set(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.name_set
+
+    def get_range(self, prefix):
+        if not prefix:
+            return 0, len(self.names)
+        lo = bisect_left(self.names, prefix)
+        hi = bisect_left(self.names, f'{prefix[:-1]}{chr(ord(prefix[-1]) + 1)}', lo)
+        return lo, hi
+
+    def get_matches(self, prefix):
+        lo, hi = self.get_range(prefix)
+        return self.names[lo:hi]
+
+    def auto_complete(self, prefix):
+        lo, hi = self.get_range(prefix)
+        if lo == hi:
+            return ''
+        return os.path.commonprefix([self.names[lo], self.names[hi - 1]])
+
+    def contained_prefix(self, s, targets=None):
+        # Narrows the range of names sharing a prefix with s one character at a time, since within that range the
+        # names are ordered by their next character. The shortest name in each range comes first and is the only candidate
+        longest = ''
+        lo, hi = 0, len(self.names)
+        for end, char in enumerate(s, 1):
+            # The name that is exactly s[:end - 1] has no next character, and was already checked
+            if lo < hi and len(self.names[lo]) < end:
+                lo += 1
+            if lo == hi:
+                break
+            get_char = itemgetter(end - 1)
+            lo = bisect_left(self.names, char, lo, hi, key=get_char)
+            hi = bisect_right(self.names, char, lo, hi, key=get_char)
+            if lo == hi:
+                break
+            name = self.names[lo]
+            if hi - lo == 1:
+                # With a single name left, either the rest of it matches s or no longer name can
+                if s.startswith(name) and (targets is None or name in targets):
+                    longest = name
+                break
+            if len(name) == end and (targets is None or name in targets):
+                longest = name
+        return longest
+
+
+def get_grams(s, gram_size):
+    padded = f'{" " * (gram_size - 1)}{s} '
+    return {padded[i:i + gram_size] for i in range(len(padded) - gram_size + 1)}
+
+
+class FuzzyIndex:
+    def __init__(self, names, pos=None, gram_size=3):
+        self.names = list(names)
+        self.pos = pos
+        self.gram_size = gram_size
+        self.max_distance = 1.0
+        if pos is not None and len(pos):
+            self.max_distance = max(1.0, float(np.hypot(*(pos.max(axis=0) - pos.min(axis=0)))))
+
+        postings = {}
+        self.gram_counts = np.empty(len(self.names))
+        for i, name in enumerate(self.names):
+            grams = get_grams(name, gram_size)
+            self.gram_counts[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self.postings = {k: np.array(v, dtype=np.int32) for k, v in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_similarities(self, text):
+        grams = get_grams(text, self.gram_size)
+        postings = [self.postings[x] for x in grams if x in self.postings]
+        if not postings:
+            return None
+        common = np.bincount(np.concatenate(postings), minlength=len(self.names))
+        return 2.0 * common / (len(grams) + self.gram_counts)
+
+    def query(self, text, count=5, pos=None, distance_weight=0.1, min_similarity=0.25):
+        similarities = self.get_similarities(text)
+        if similarities is None:
+            return []
+        ids = np.flatnonzero(similarities >= min_similarity)
+        scores = similarities[ids]
+        if pos is not None and self.pos is not None:
+            distances = np.hypot(self.pos[ids, 0] - pos[0], self.pos[ids, 1] - pos[1])
+            scores = scores - distance_weight * distances / self.max_distance
+        order = np.arange(len(scores))
+        if len(order) > count:
+            order = np.argpartition(-scores, count)[:count]
+        order = order[np.argsort(-scores[order], kind='stable')]
+        return [(self.names[ids[i]], float(scores[i])) for i in order]
+
+
+indices = {}
+
+
+def get_index(key, get_names, *args):
+    index = indices.get(key)
+    if index is None:
+        index = PrefixIndex(get_names(*args))
+        indices[key] = index
+    return index
@@ -6,9 +6,11 @@ import time as pt
 import constants
 import game
 import helpers
+import images
 import keys
 
 from abc import ABCMeta
+from pygame import Rect
 from sprites import Sprite
 
 
@@ -25,6 +27,8 @@ class Ship(Sprite, metaclass=ABCMeta):
         self.angle = angle
         self.ang_vel = ang_vel
         self.dir = np.array([np.cos(angle), np.sin(angle)])
+        self.prev_pos = None
+        self.prev_angle = None
         self.set_rect()
         self.radius = self.get_collision_radius()
 
@@ -34,7 +38,10 @@ class Ship(Sprite, metaclass=ABCMeta):
 
     def set_rect(self):
         super().set_rect()
-        self.image, self.rect = helpers.rotate(self.base_image, self.rect, self.angle)
+        self.image, self.rect = images.rotate(self.base_image, self.rect, self.angle)
+
+    def get_frame(self, pos, angle):
+        return images.rotate(self.base_image, Rect(pos[0], pos[1], 0, 0), angle)
 
     def get_collision_radius(self):
         return constants.inv_sqrt2 * super().get_collision_radius()
@@ -42,6 +49,26 @@ class Ship(Sprite, metaclass=ABCMeta):
     def rect_blit(self, camera):
         return self.rect.move(-camera[0], -camera[1])
 
+    def store_prev(self):
+        self.prev_pos = self.pos.copy()
+        self.prev_angle = self.angle
+
+    def get_render_pos(self, alpha):
+        if self.prev_pos is None or alpha >= 1.0:
+            return self.pos
+        return self.prev_pos + alpha * (self.pos - self.prev_pos)
+
+    def get_render_angle(self, alpha):
+        if self.prev_pos is None or alpha >= 1.0:
+            return self.angle
+        return self.prev_angle + alpha * helpers.angle_diff(self.angle, self.prev_angle)
+
+    def draw_interpolated(self, camera, alpha):
+        image, rect = self.get_frame(self.get_render_pos(alpha), self.get_render_angle(alpha))
+        rect_blit = rect.move(-camera[0], -camera[1])
+        if rect_blit.colliderect(game.screen.display_rect):
+            game.screen.draw(image, rect_blit)
+
     def update(self, pressed, target_pos, dt):
         raise NotImplementedError
 
@@ -118,6 +145,9 @@ class InterceptShip(NPCShip):
             Sprite.set_rect(self)
             self.image, self.rect = helpers.rotate(self.base_image, self.rect, 0.0)
 
+    def get_frame(self, pos, angle):
+        return super().get_frame(pos, angle if self.rotate else 0.0)
+
     def update(self, pressed, target_pos, dt):
         self.autopilot_update(target_pos, dt)
         self.update_dir()
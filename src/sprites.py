@@ -1,4 +1,5 @@
 import game
+import images
 import pygame as pg
 
 from pygame import Surface
@@ -7,17 +8,11 @@ from pygame import Surface
 class Sprite(pg.sprite.Sprite):
     def __init__(self, image, scale, pos):
         super().__init__()
-        self.image = image if isinstance(image, Surface) else pg.image.load(image).convert_alpha()
-
-        scaled_rect = self.image.get_rect()
-        if isinstance(scale, (int, float)):
-            self.scale = scale
+        if isinstance(image, Surface):
+            self.scale = images.get_scale(image, scale)
+            self.image = images.scale_image(image, self.scale)
         else:
-            image_dim = scaled_rect.width if game.screen.display_min_dim_index == 0 else scaled_rect.height
-            self.scale = scale[0] * game.screen.display_min_dim / image_dim
-        if self.scale != 1.0:
-            scaled_size = self.scale * scaled_rect.width, self.scale * scaled_rect.height
-            self.image = pg.transform.smoothscale(self.image, scaled_size)
+            self.image, self.scale = images.cache.get(image, scale, self)
 
         self.pos = pos
 
@@ -0,0 +1,96 @@
+import builtins
+import sys
+import threading
+import time as pt
+
+
+enabled = False
+min_import_time = 0.001
+
+start = pt.perf_counter()
+last_time = start
+stages = []
+imports = []
+import_stack = []
+reported = False
+lock = threading.Lock()
+original_import = builtins.__import__
+
+
+def get_time():
+    return pt.perf_counter()
+
+
+def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Like python -X importtime: each first import gets its total time and the part not spent importing other modules
+    if level or name in sys.modules or threading.current_thread() is not threading.main_thread():
+        return original_import(name, globals, locals, fromlist, level)
+    index = len(imports)
+    imports.append(None)
+    import_stack.append(0.0)
+    begin = pt.perf_counter()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        total = pt.perf_counter() - begin
+        children = import_stack.pop()
+        if import_stack:
+            import_stack[-1] += total
+        imports[index] = (len(import_stack), name, begin - start, total, total - children)
+
+
+def set_enabled(value):
+    global enabled
+    enabled = value
+    builtins.__import__ = timed_import if value else original_import
+
+
+def end_imports():
+    builtins.__import__ = original_import
+    lap('imports')
+
+
+def add(name, begin, end=None):
+    if not enabled:
+        return
+    stage = (name, begin - start, (pt.perf_counter() if end is None else end) - begin)
+    with lock:
+        stages.append(stage)
+        # Stages that finish in the background after the first frame are printed as they come in
+        if reported:
+            print(format_stage(*stage))
+
+
+def lap(name):
+    global last_time
+    if not enabled:
+        return
+    now = pt.perf_counter()
+    add(name, last_time, now)
+    last_time = now
+
+
+def format_stage(name, begin, duration, self_time=None):
+    line = f'{name:<40}{begin:10.3f}{duration:10.3f}'
+    return line if self_time is None else f'{line}{self_time:10.3f}'
+
+
+def get_lines():
+    lines = [f'{"stage":<40}{"start":>10}{"time":>10}{"self":>10}']
+    for name, begin, duration in stages:
+        lines.append(format_stage(name, begin, duration))
+        if name == 'imports':
+            for depth, module_name, module_begin, total, self_time in imports:
+                if total >= min_import_time:
+                    lines.append(format_stage(f'{"  " * (depth + 1)}{module_name}', module_begin, total, self_time))
+    return lines
+
+
+def first_frame():
+    global reported
+    if not enabled or reported:
+        return
+    lap('first frame')
+    with lock:
+        print('\n'.join(get_lines()))
+        reported = True
@@ -1,20 +1,21 @@
-import numba
 import numpy as np
 
+import jit
 
-@numba.njit
+
+@jit.njit('float64[::1]')
 def normalize(vec):
     norm = np.linalg.norm(vec)
     return vec if norm == 0.0 else vec / norm
 
 
-@numba.njit
+@jit.njit('float64[::1]')
 def norm_tuple(vec):
     norm = np.linalg.norm(vec)
     return (vec if norm == 0.0 else vec / norm), norm
 
 
-@numba.njit
+@jit.njit('float64[::1], float64')
 def rotate(vec, angle):
     x, y = vec[0], vec[1]
     cos, sin = np.cos(angle), np.sin(angle)